@@ -1,24 +1,57 @@
+import threading
+from collections import OrderedDict
 import numpy as np
+import pandas as pd
 from datetime import datetime
+from bulk_sql import upsert
 from models import AnomalyAlert, db
+from joblib import Parallel, delayed
 from sklearn.neighbors import LocalOutlierFactor
 
+# Parallel jobs used to fit per-building LOF models (-1 uses every CPU)
+LOF_JOBS = -1
+
+# Readings to fit below which LOF models are fitted in-process; smaller runs finish
+# before a worker pool would have started
+LOF_PARALLEL_MIN_ROWS = 100000
+
+# Fitted per-building LOF models kept for reuse_model, least recently used dropped first
+LOF_MODEL_CACHE_SIZE = 1000
+
+
+def _fit_building_lof(values, n_neighbors, contamination):
+    """Fit a novelty LOF model on one building's readings (runs in a joblib worker)"""
+    model = LocalOutlierFactor(
+        n_neighbors=min(n_neighbors, len(values) - 1),
+        contamination=contamination,
+        novelty=True
+    )
+    return model.fit(values.reshape(-1, 1))
+
+
 class AnomalyDetector:
     def __init__(self):
+        # Fitted per-building LOF models, keyed by (building, n_neighbors, contamination);
+        # shared by request threads, so guarded by a lock
+        self._lof_models = OrderedDict()
+        self._lof_models_lock = threading.Lock()
     
-        pass
-    
-    def detect_anomalies(self, data, method='z_score', threshold=3.0, n_neighbors=100, contamination=0.1, system_clock=None):
+    def detect_anomalies(self, data, method='z_score', threshold=3.0, n_neighbors=100, contamination=0.1, system_clock=None, by_weekday=False, window=30, reuse_model=False):
         """
         Detect anomalies in electricity consumption data using the specified method.
 
         Args:
             data: List of dictionaries with 'date', 'consumption', and 'building' keys
-            method: Anomaly detection method ('z_score' or 'LOF')
+            method: Anomaly detection method ('z_score', 'grouped_z_score', 'rolling_z_score', 'mad',
+                'LOF' or 'building_LOF')
             threshold: Threshold for anomaly detection (Z-Score or LOF sensitivity)
             n_neighbors: Number of neighbors for LOF (default=100)
             contamination: Expected proportion of outliers for LOF (default=1)
             system_clock: Optional datetime object to use as the detection time
+            by_weekday: For 'grouped_z_score', also group by day of the week
+            window: For 'rolling_z_score', number of previous readings each one is compared to
+            reuse_model: For 'building_LOF', score with the building's previously fitted model
+                instead of refitting (buildings without one are fitted)
 
         Returns:
             List of anomalies with severity classification
@@ -76,9 +109,208 @@ class AnomalyDetector:
                     })
             return anomalies
 
+        elif method == 'building_LOF':
+            return self._detect_building_lof(data, n_neighbors, contamination, reuse_model, detection_time)
+
+        elif method == 'grouped_z_score':
+            return self._detect_grouped_z_score(data, threshold, by_weekday, detection_time)
+
+        elif method == 'rolling_z_score':
+            return self._detect_rolling_z_score(data, threshold, window, detection_time)
+
+        elif method == 'mad':
+            return self._detect_mad(data, threshold, detection_time)
+
         else:
             raise ValueError(f"Unsupported detection method: {method}")
 
+    def _detect_grouped_z_score(self, data, threshold, by_weekday, detection_time):
+        """
+        Z-Score against each building's own mean and standard deviation (and weekday's, if by_weekday).
+
+        Statistics come from one groupby over the whole list and every row is scored with
+        array operations, so a large building no longer sets the baseline for small ones.
+        """
+        frame = self._to_frame(data)
+        keys = [frame['building']]
+        if by_weekday:
+            keys.append(pd.to_datetime(frame['date']).dt.weekday)
+
+        grouped = frame['consumption'].groupby(keys)
+        mean = grouped.transform('mean').to_numpy()
+        std_dev = grouped.transform('std', ddof=0).to_numpy()
+        return self._flag(frame, mean, std_dev, threshold, 'grouped_z_score', detection_time)
+
+    def _detect_rolling_z_score(self, data, threshold, window, detection_time):
+        """
+        Z-Score against the mean and standard deviation of each building's previous window readings.
+
+        The baseline follows seasonal drift, and a reading never counts towards its own
+        baseline. Window sums come from cumulative sums over all buildings at once, so this
+        is O(n); readings with fewer than window // 2 (at least 3) predecessors are not scored.
+        """
+        frame = self._to_frame(data)
+        codes = pd.factorize(frame['building'])[0]
+        order = np.lexsort((pd.to_datetime(frame['date']).to_numpy(), codes))
+        frame = frame.iloc[order].reset_index(drop=True)
+        codes = codes[order]
+        values = frame['consumption'].to_numpy()
+
+        # Each reading's window is [lo, i), clamped to the start of its building's rows
+        positions = np.arange(len(values))
+        starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+        group_start = np.repeat(starts, np.diff(np.r_[starts, len(values)]))
+        lo = np.maximum(group_start, positions - window)
+        counts = positions - lo
+
+        # Deviations from the building mean keep the running sums small
+        building_mean = np.bincount(codes, weights=values) / np.bincount(codes)
+        deviations = values - building_mean[codes]
+        sums = np.r_[0.0, np.cumsum(deviations)]
+        squares = np.r_[0.0, np.cumsum(deviations ** 2)]
+
+        scored = counts >= max(3, window // 2)
+        safe_counts = np.where(scored, counts, 1)
+        window_mean = (sums[positions] - sums[lo]) / safe_counts
+        variance = (squares[positions] - squares[lo]) / safe_counts - window_mean ** 2
+
+        center = np.where(scored, window_mean + building_mean[codes], np.nan)
+        spread = np.where(scored, np.sqrt(np.clip(variance, 0, None)), 0.0)
+        return self._flag(frame, center, spread, threshold, 'rolling_z_score', detection_time)
+
+    def _detect_mad(self, data, threshold, detection_time):
+        """
+        Robust z-score from each building's median and median absolute deviation (MAD).
+
+        0.6745 * (x - median) / MAD is on the same scale as a z-score for normal data, but
+        a few extreme readings cannot inflate the spread and hide the others. When more
+        than half of a building's readings equal the median the MAD is 0, so the mean
+        absolute deviation from the median, scaled by 1.2533 (sqrt(pi / 2)), is used instead.
+        """
+        frame = self._to_frame(data)
+        grouped = frame['consumption'].groupby(frame['building'])
+        median = grouped.transform('median')
+        deviation = (frame['consumption'] - median).abs().groupby(frame['building'])
+        spread = deviation.transform('median').to_numpy() / 0.6745
+        spread = np.where(spread > 0, spread, deviation.transform('mean').to_numpy() * 1.2533)
+        return self._flag(frame, median.to_numpy(), spread, threshold, 'mad', detection_time)
+
+    def _detect_building_lof(self, data, n_neighbors, contamination, reuse_model, detection_time):
+        """
+        LOF fitted separately on each building's readings, in parallel with joblib for large runs.
+
+        n_neighbors is clamped to the building's row count, and buildings with fewer than
+        three readings and no fitted model are skipped. Each fit is a novelty=True model
+        kept on the detector together with the dates it was trained on and the training
+        outliers. On a fresh fit the training readings are labelled from the fit itself,
+        as fit_predict would. With reuse_model, readings on training dates keep the labels
+        from the fit and every other reading, earlier or later, is scored with the model.
+        """
+        frame = self._to_frame(data)
+        codes, names = pd.factorize(frame['building'])
+        rows_by_code = np.split(np.argsort(codes, kind='stable'), np.cumsum(np.bincount(codes))[:-1])
+        groups = dict(zip(names, rows_by_code))
+        values = frame['consumption'].to_numpy()
+        dates, buildings = frame['date'].to_numpy(), frame['building'].to_numpy()
+
+        models = {}
+        if reuse_model:
+            with self._lof_models_lock:
+                for building in groups:
+                    fitted = self._lof_models.get((building, n_neighbors, contamination))
+                    if fitted is not None:
+                        self._lof_models.move_to_end((building, n_neighbors, contamination))
+                        models[building] = fitted
+
+        # Buildings with fewer than three readings are too small to fit a model on
+        to_fit = [building for building, rows in groups.items() if len(rows) >= 3 and building not in models]
+        rows_to_fit = sum(len(groups[building]) for building in to_fit)
+        n_jobs = LOF_JOBS if len(to_fit) > 1 and rows_to_fit >= LOF_PARALLEL_MIN_ROWS else 1
+        fitted_models = Parallel(n_jobs=n_jobs)(
+            delayed(_fit_building_lof)(values[groups[building]], n_neighbors, contamination) for building in to_fit
+        )
+
+        refitted = {}
+        for building, model in zip(to_fit, fitted_models):
+            rows = groups[building]
+            # Training rows: the same labels fit_predict would give
+            scores = model.negative_outlier_factor_
+            outliers = scores < model.offset_
+            refitted[building] = scores
+            models[building] = {
+                'model': model,
+                'trained_dates': frozenset(dates[rows]),
+                'outliers': dict(zip(dates[rows][outliers], scores[outliers]))
+            }
+        if refitted:
+            with self._lof_models_lock:
+                for building in refitted:
+                    self._lof_models[(building, n_neighbors, contamination)] = models[building]
+                    self._lof_models.move_to_end((building, n_neighbors, contamination))
+                while len(self._lof_models) > LOF_MODEL_CACHE_SIZE:
+                    self._lof_models.popitem(last=False)
+
+        anomalies = []
+        for building, fitted in models.items():
+            rows = groups[building]
+            model = fitted['model']
+            if building in refitted:
+                scores = refitted[building]
+                outliers = scores < model.offset_
+            else:
+                # Readings the model was trained on keep their training labels
+                scores = np.array([fitted['outliers'].get(day, 0.0) for day in dates[rows]])
+                outliers = np.array([day in fitted['outliers'] for day in dates[rows]], dtype=bool)
+                new = np.array([day not in fitted['trained_dates'] for day in dates[rows]], dtype=bool)
+                if new.any():
+                    scores[new] = model.score_samples(values[rows[new]].reshape(-1, 1))
+                    outliers[new] = scores[new] < model.offset_
+
+            for row, score in zip(rows[outliers], scores[outliers]):
+                normalized_score = abs(score)
+                anomalies.append({
+                    'date': dates[row],
+                    'consumption': float(values[row]),
+                    'lof_score': float(normalized_score),
+                    'severity': self._classify_severity(normalized_score),
+                    'building': buildings[row],
+                    'detection_method': 'building_LOF',
+                    'detection_time': detection_time
+                })
+        return anomalies
+
+    def _to_frame(self, data):
+        """Columns of the detection input, for the vectorized methods"""
+        return pd.DataFrame({
+            'date': [item['date'] for item in data],
+            'consumption': np.array([float(item['consumption']) for item in data]),
+            'building': [item['building'] for item in data]
+        })
+
+    def _flag(self, frame, center, spread, threshold, method, detection_time):
+        """
+        Score every row as (consumption - center) / spread and return the rows beyond threshold.
+
+        Rows without a baseline (NaN center) or with zero spread score 0.
+        """
+        scorable = (spread > 0) & ~np.isnan(center)
+        z_scores = np.zeros(len(frame))
+        dates, values, buildings = (frame[column].to_numpy() for column in ('date', 'consumption', 'building'))
+        np.divide(values - center, spread, out=z_scores, where=scorable)
+        flagged = np.flatnonzero(np.abs(z_scores) > threshold)
+
+        return [{
+            'date': dates[i],
+            'consumption': float(values[i]),
+            'z_score': float(z_scores[i]),
+            'severity': "Critical" if abs(z_scores[i]) > threshold + 1 else "Warning",
+            'building': buildings[i],
+            'expected_low': float(center[i] - threshold * spread[i]),
+            'expected_high': float(center[i] + threshold * spread[i]),
+            'detection_method': method,
+            'detection_time': detection_time
+        } for i in flagged]
+
     def _classify_severity(self, lof_score):
         """Classify the severity of an anomaly based on its LOF score - only Critical or Warning"""
         if lof_score > 1.1:  # Previously the threshold for "Error"
@@ -90,39 +322,44 @@ class AnomalyDetector:
         """
         Store detected anomalies in the database
         
+        Existing alerts for the same (date, building, detection_method) are updated in place,
+        keeping their acknowledged/cleared/SDT flags. One SELECT finds which keys already
+        exist and one multi-row upsert on uix_anomaly_building_date_method writes them all.
+        
         Args:
             anomalies: List of anomaly dictionaries
             
         Returns:
             Number of new anomalies stored
         """
-        new_count = 0
-        
+        # One row per unique key; the last occurrence wins, as it did with row-by-row updates
+        rows = {}
         for anomaly in anomalies:
-            # Check if this anomaly already exists using the unique constraint
-            existing = AnomalyAlert.query.filter_by(
-                date=anomaly['date'],
-                building=anomaly['building'],
-                detection_method=anomaly['detection_method']
-            ).first()
-            
-            if existing:
-                # Update existing anomaly
-                existing.consumption = anomaly['consumption']
-                existing.z_score = anomaly.get('lof_score', 0)  # Store LOF score in z_score field
-                existing.severity = anomaly['severity']
-            else:
-                # Create new anomaly alert
-                new_alert = AnomalyAlert(
-                    date=anomaly['date'],
-                    building=anomaly['building'],
-                    consumption=anomaly['consumption'],
-                    z_score=anomaly.get('lof_score', 0),  # Store LOF score in z_score field
-                    severity=anomaly['severity'],
-                    detection_method=anomaly['detection_method']
-                )
-                db.session.add(new_alert)
-                new_count += 1
-        
+            rows[(anomaly['date'], anomaly['building'], anomaly['detection_method'])] = {
+                'date': anomaly['date'],
+                'building': anomaly['building'],
+                'consumption': anomaly['consumption'],
+                'z_score': anomaly.get('z_score', anomaly.get('lof_score', 0)),  # LOF methods store their LOF score here
+                'severity': anomaly['severity'],
+                'detection_method': anomaly['detection_method']
+            }
+        if not rows:
+            return 0
+
+        dates = [date for date, _, _ in rows]
+        existing = {tuple(key) for key in db.session.query(
+            AnomalyAlert.date, AnomalyAlert.building, AnomalyAlert.detection_method
+        ).filter(
+            AnomalyAlert.building.in_({building for _, building, _ in rows}),
+            AnomalyAlert.detection_method.in_({method for _, _, method in rows}),
+            AnomalyAlert.date >= min(dates),
+            AnomalyAlert.date <= max(dates)
+        )}
+        new_count = sum(1 for key in rows if key not in existing)
+
+        db.session.execute(
+            upsert(AnomalyAlert, ['date', 'building', 'detection_method'], ['consumption', 'z_score', 'severity']),
+            list(rows.values())
+        )
         db.session.commit()
-        return new_count
\ No newline at end of file
+        return new_count
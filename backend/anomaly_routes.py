@@ -1,6 +1,7 @@
 from flask import Blueprint, jsonify, request
 from models import AnomalyAlert, ElectricityData, db
 from AnomalyDetector import AnomalyDetector
+from anomaly_watermarks import data_fingerprint, detector_options, find_watermark, load_stored_alerts, record_watermark
 from datetime import datetime
 from urllib.parse import unquote
 
@@ -20,6 +21,10 @@ def analyze_anomalies():
         method = data.get('method', 'z_score')
         threshold = float(data.get('threshold', 3.0))
         system_clock = data.get('system_clock')  # Get system clock from frontend
+        by_weekday = bool(data.get('by_weekday', False))  # Per-weekday baselines for grouped_z_score
+        window = int(data.get('window', 30))  # Previous readings compared against for rolling_z_score
+        reuse_model = bool(data.get('reuse_model', False))  # Score with fitted building_LOF models
+        force = bool(data.get('force', False))  # Re-run even if the data has not changed since the last run
         
         # Decode building name if it's URL encoded
         if building:
@@ -36,37 +41,49 @@ def analyze_anomalies():
             else:
                 end_date = datetime(year, month + 1, 1).date()
         
-        # Query data from database
-        query = ElectricityData.query.filter(
-            ElectricityData.date >= start_date,
-            ElectricityData.date < end_date
-        )
-        
-        if building:  # Filter by building if specified
-            query = query.filter(ElectricityData.building == building)
-        
-        db_data = query.order_by(ElectricityData.date).all()
-        
-        if not db_data:
+        # Skip detection when this analysis already ran over the same data
+        fingerprint = data_fingerprint(building, start_date, end_date)
+        if not fingerprint[0]:
             return jsonify({'error': 'No data found for the specified parameters'}), 404
-        
-        # Format data for anomaly detection
-        formatted_data = [{
-            'date': entry.date,
-            'consumption': entry.consumption,
-            'building': entry.building
-        } for entry in db_data]
-        
-        # Detect anomalies
-        anomalies = anomaly_detector.detect_anomalies(
-            formatted_data,
-            method=method,
-            threshold=threshold,
-            system_clock=datetime.fromisoformat(system_clock) if system_clock else None  # Pass system clock
-        )
-        
-        # Store anomalies in database
-        new_anomalies = anomaly_detector.store_anomalies(anomalies)
+        options = detector_options(method, by_weekday=by_weekday, window=window, reuse_model=reuse_model)
+        watermark = None if force else find_watermark(building, start_date, end_date, method, threshold, options, fingerprint)
+
+        if watermark is not None:
+            anomalies = load_stored_alerts(watermark)
+            new_anomalies = 0
+        else:
+            # Query data from database
+            query = ElectricityData.query.filter(
+                ElectricityData.date >= start_date,
+                ElectricityData.date < end_date
+            )
+            
+            if building:  # Filter by building if specified
+                query = query.filter(ElectricityData.building == building)
+            
+            db_data = query.order_by(ElectricityData.date).all()
+            
+            # Format data for anomaly detection
+            formatted_data = [{
+                'date': entry.date,
+                'consumption': entry.consumption,
+                'building': entry.building
+            } for entry in db_data]
+            
+            # Detect anomalies
+            anomalies = anomaly_detector.detect_anomalies(
+                formatted_data,
+                method=method,
+                threshold=threshold,
+                system_clock=datetime.fromisoformat(system_clock) if system_clock else None,  # Pass system clock
+                by_weekday=by_weekday,
+                window=window,
+                reuse_model=reuse_model
+            )
+            
+            # Store anomalies in database
+            new_anomalies = anomaly_detector.store_anomalies(anomalies)
+            record_watermark(building, start_date, end_date, method, threshold, options, fingerprint, anomalies)
         
         # Return results with formatted dates for display
         for anomaly in anomalies:
@@ -79,7 +96,8 @@ def analyze_anomalies():
             'count': len(anomalies),
             'new_count': new_anomalies,
             'critical': sum(1 for a in anomalies if a['severity'] == 'Critical'),
-            'warning': sum(1 for a in anomalies if a['severity'] == 'Warning')
+            'warning': sum(1 for a in anomalies if a['severity'] == 'Warning'),
+            'from_stored_results': watermark is not None
         })
         
     except TypeError as e:
@@ -0,0 +1,189 @@
+import json
+from datetime import datetime
+from sqlalchemy import insert, or_
+from bulk_sql import upsert
+from models import db, AnomalyAlert, AnomalyWatermark, AnomalyWatermarkAlert, ElectricityData
+
+# Methods whose stored score is a z-score, classified against the threshold
+Z_SCORE_METHODS = {'z_score', 'grouped_z_score', 'rolling_z_score', 'mad'}
+
+# Methods that score each building on its own, so an all-building run matches per-building runs
+PER_BUILDING_METHODS = {'grouped_z_score', 'rolling_z_score', 'mad', 'building_LOF'}
+
+# Detector options each method's output depends on; they are part of a watermark's key
+METHOD_OPTIONS = {
+    'grouped_z_score': ('by_weekday',),
+    'rolling_z_score': ('window',),
+    'building_LOF': ('reuse_model',)
+}
+
+# Ids per statement when deleting or linking watermarks and alerts
+BATCH_SIZE = 1000
+
+
+def data_fingerprint(building, start_date, end_date):
+    """
+    Row count and highest id of the readings an analysis would see (one query).
+
+    Uploads only ever add rows, so the pair changes whenever new data arrives in the period.
+
+    Args:
+        building: Building name, or None for every building
+        start_date: First day of the period
+        end_date: Day after the period
+    """
+    query = db.session.query(db.func.count(ElectricityData.id), db.func.max(ElectricityData.id)).filter(
+        ElectricityData.date >= start_date,
+        ElectricityData.date < end_date
+    )
+    if building:
+        query = query.filter(ElectricityData.building == building)
+    count, max_id = query.one()
+    return count, max_id or 0
+
+
+def detector_options(method, **options):
+    """
+    Normalize the detector options a method's output depends on into a watermark key.
+
+    Options the method ignores are left out, so e.g. a z_score run is reused whatever
+    window was sent with it.
+
+    Args:
+        method: Detection method of the run
+        options: Keyword arguments passed to AnomalyDetector.detect_anomalies
+
+    Returns:
+        JSON string with sorted keys ('' for methods without options)
+    """
+    relevant = {name: options[name] for name in METHOD_OPTIONS.get(method, ()) if name in options}
+    return json.dumps(relevant, sort_keys=True, separators=(',', ':')) if relevant else ''
+
+
+def find_watermark(building, start_date, end_date, method, threshold, options, fingerprint):
+    """Return the watermark of a stored run over exactly this data and options, or None if it must run again"""
+    if not building and method not in PER_BUILDING_METHODS:
+        # Stored alerts cannot tell an all-building run of a population-wide method from per-building runs
+        return None
+    watermark = AnomalyWatermark.query.filter_by(
+        building=building or '',
+        period_start=start_date,
+        period_end=end_date,
+        detection_method=method,
+        threshold=threshold,
+        options=options
+    ).first()
+    if watermark is None or (watermark.row_count, watermark.max_data_id) != tuple(fingerprint):
+        return None
+    return watermark
+
+
+def record_watermark(building, start_date, end_date, method, threshold, options, fingerprint, anomalies, statistics=None):
+    """
+    Record that a run's alerts are stored, and which alerts it flagged (commits).
+
+    Stored alerts are never deleted, since they carry the user's acknowledged, cleared
+    and SDT flags; a stored read returns the alerts linked to its watermark instead of
+    every alert in the period. Alerts are keyed by (date, building, method) only, so
+    storing a run overwrites the scores other scopes, or the same scope with other
+    options, stored for the same days; their watermarks are dropped here. Runs of the
+    same scope and options at other thresholds stay valid, since the same data gives
+    the same scores. All-building runs of population-wide methods still drop the
+    watermarks they overwrote but are not recorded, since find_watermark never reuses them.
+
+    Args:
+        building: Building name, or None for every building
+        start_date: First day of the period
+        end_date: Day after the period
+        method: Detection method of the run
+        threshold: Threshold of the run
+        options: detector_options() of the run
+        fingerprint: data_fingerprint() of the data the run saw
+        anomalies: The run's anomaly dictionaries, already stored
+        statistics: Optional summary statistics to keep with the run
+    """
+    building = building or ''
+    overlapping = db.session.query(AnomalyWatermark.id).filter(
+        AnomalyWatermark.detection_method == method,
+        AnomalyWatermark.period_start < end_date,
+        AnomalyWatermark.period_end > start_date,
+        or_(AnomalyWatermark.period_start != start_date, AnomalyWatermark.period_end != end_date,
+            AnomalyWatermark.building != building, AnomalyWatermark.options != options)
+    )
+    if building:
+        overlapping = overlapping.filter(AnomalyWatermark.building.in_([building, '']))
+    _delete_watermarks([watermark_id for watermark_id, in overlapping])
+    if not building and method not in PER_BUILDING_METHODS:
+        db.session.commit()
+        return
+
+    scope = {
+        'building': building,
+        'period_start': start_date,
+        'period_end': end_date,
+        'detection_method': method,
+        'threshold': threshold,
+        'options': options
+    }
+    db.session.execute(
+        upsert(AnomalyWatermark, list(scope), ['row_count', 'max_data_id', 'statistics', 'analyzed_at']),
+        [{
+            **scope,
+            'row_count': fingerprint[0],
+            'max_data_id': fingerprint[1],
+            'statistics': json.dumps(statistics) if statistics is not None else None,
+            'analyzed_at': datetime.utcnow()
+        }]
+    )
+    watermark_id = db.session.query(AnomalyWatermark.id).filter_by(**scope).scalar()
+
+    # Replace the links of an earlier run of this scope with this run's alerts
+    AnomalyWatermarkAlert.query.filter_by(watermark_id=watermark_id).delete(synchronize_session=False)
+    flagged = {(anomaly['date'], anomaly['building']) for anomaly in anomalies}
+    if flagged:
+        query = db.session.query(AnomalyAlert.id, AnomalyAlert.date, AnomalyAlert.building).filter(
+            AnomalyAlert.detection_method == method,
+            AnomalyAlert.date >= start_date,
+            AnomalyAlert.date < end_date
+        )
+        if building:
+            query = query.filter(AnomalyAlert.building == building)
+        links = [{'watermark_id': watermark_id, 'alert_id': alert_id}
+                 for alert_id, date, alert_building in query if (date, alert_building) in flagged]
+        for start in range(0, len(links), BATCH_SIZE):
+            db.session.execute(insert(AnomalyWatermarkAlert), links[start:start + BATCH_SIZE])
+    db.session.commit()
+
+
+def _delete_watermarks(watermark_ids):
+    """Delete watermarks and their alert links, leaving the alerts themselves (caller commits)"""
+    for start in range(0, len(watermark_ids), BATCH_SIZE):
+        batch = watermark_ids[start:start + BATCH_SIZE]
+        AnomalyWatermarkAlert.query.filter(AnomalyWatermarkAlert.watermark_id.in_(batch)).delete(synchronize_session=False)
+        AnomalyWatermark.query.filter(AnomalyWatermark.id.in_(batch)).delete(synchronize_session=False)
+
+
+def load_stored_alerts(watermark):
+    """Rebuild a stored run's anomaly list from the alerts linked to its watermark, in the detector's output format"""
+    query = AnomalyAlert.query.join(
+        AnomalyWatermarkAlert, AnomalyWatermarkAlert.alert_id == AnomalyAlert.id
+    ).filter(AnomalyWatermarkAlert.watermark_id == watermark.id)
+
+    anomalies = []
+    for alert in query.order_by(AnomalyAlert.date, AnomalyAlert.building).all():
+        anomaly = {
+            'date': alert.date,
+            'consumption': alert.consumption,
+            'severity': alert.severity,
+            'building': alert.building,
+            'detection_method': alert.detection_method,
+            'detection_time': alert.created_at
+        }
+        if watermark.detection_method in Z_SCORE_METHODS:
+            anomaly['z_score'] = alert.z_score
+            # A run of the same scope at another threshold may have stored the severity last
+            anomaly['severity'] = "Critical" if abs(alert.z_score) > watermark.threshold + 1 else "Warning"
+        else:
+            anomaly['lof_score'] = alert.z_score  # LOF scores are stored in the z_score column
+        anomalies.append(anomaly)
+    return anomalies
@@ -0,0 +1,155 @@
+import hashlib
+from datetime import date, datetime
+import numpy as np
+from bulk_sql import upsert
+from models import db, ElectricityData, DataAvailability
+
+# Bytes needed for one bit per day of a leap year
+BITMAP_BYTES = 46
+
+# Rows fetched at a time when rebuilding the index from ElectricityData
+REBUILD_BATCH_SIZE = 50000
+
+
+def _day_bits(bitmap):
+    """Unpack a stored bitmap into a boolean array indexed by day of year - 1"""
+    return np.unpackbits(np.frombuffer(bitmap, dtype=np.uint8), bitorder='little').astype(bool)
+
+
+def _pack_days(bits):
+    return np.packbits(bits, bitorder='little').tobytes()
+
+
+def _collect_days(pairs):
+    """Fold (building, date) pairs into one boolean day array per (building, year)"""
+    bitmaps = {}
+    for building, day in pairs:
+        bits = bitmaps.get((building, day.year))
+        if bits is None:
+            bits = bitmaps[(building, day.year)] = np.zeros(BITMAP_BYTES * 8, dtype=bool)
+        bits[day.timetuple().tm_yday - 1] = True
+    return bitmaps
+
+
+def mark_days_available(pairs, lock_rows=True):
+    """
+    Set the bits for newly written (building, date) pairs in the availability index (caller commits).
+
+    Reads the touched (building, year) bitmaps with one query, ORs the new days in,
+    and writes them back with one upsert.
+
+    Args:
+        pairs: Iterable of (building, date) tuples
+        lock_rows: Lock the touched bitmaps so concurrent writers do not lose bits
+    """
+    bitmaps = _collect_days(pairs)
+    if not bitmaps:
+        return
+
+    query = DataAvailability.query.filter(
+        DataAvailability.building.in_(list({building for building, _ in bitmaps})),
+        DataAvailability.year.in_(list({year for _, year in bitmaps}))
+    )
+    if lock_rows:
+        query = query.with_for_update()
+    versions = {}
+    for row in query.all():
+        if (row.building, row.year) in bitmaps:
+            bitmaps[(row.building, row.year)] |= _day_bits(row.days)
+            versions[(row.building, row.year)] = row.version
+
+    rows = [{
+        'building': building,
+        'year': year,
+        'days': _pack_days(bits),
+        'version': versions.get((building, year), 0) + 1,
+        'updated_at': datetime.utcnow()
+    } for (building, year), bits in bitmaps.items()]
+    db.session.execute(upsert(DataAvailability, ['building', 'year'], ['days', 'version', 'updated_at']), rows)
+
+
+def rebuild_availability_index(buildings=None):
+    """
+    Rebuild the availability index from ElectricityData in one streamed pass.
+
+    Args:
+        buildings: Only rebuild these buildings (default: all of them)
+    """
+    stale = db.session.query(DataAvailability)
+    pairs = db.session.query(ElectricityData.building, ElectricityData.date)
+    if buildings is not None:
+        stale = stale.filter(DataAvailability.building.in_(list(buildings)))
+        pairs = pairs.filter(ElectricityData.building.in_(list(buildings)))
+    stale.delete(synchronize_session=False)
+    mark_days_available(pairs.yield_per(REBUILD_BATCH_SIZE), lock_rows=False)
+    db.session.commit()
+
+
+def repair_availability_index():
+    """
+    Rebuild the buildings whose indexed day count no longer matches ElectricityData.
+
+    Catches drift from rows written or deleted outside the upload path. Costs one grouped
+    count over the (building, date) key plus a read of the bitmaps.
+
+    Returns:
+        Set of the buildings that were rebuilt
+    """
+    stored = dict(db.session.query(ElectricityData.building, db.func.count(ElectricityData.id))
+                  .group_by(ElectricityData.building).all())
+    indexed = {}
+    for building, days in db.session.query(DataAvailability.building, DataAvailability.days):
+        indexed[building] = indexed.get(building, 0) + int(np.count_nonzero(_day_bits(days)))
+
+    drifted = {building for building in stored.keys() | indexed.keys() if stored.get(building, 0) != indexed.get(building, 0)}
+    if drifted:
+        rebuild_availability_index(drifted)
+    return drifted
+
+
+def availability_etag():
+    """
+    ETag of the current availability index, from one aggregate query over its rows.
+
+    Every write bumps a row's version and timestamp and a rebuild changes the row set,
+    so a conditional GET can be answered without loading any bitmaps.
+    """
+    count, versions, updated_at = db.session.query(
+        db.func.count(DataAvailability.id),
+        db.func.sum(DataAvailability.version),
+        db.func.max(DataAvailability.updated_at)
+    ).one()
+    if not count and db.session.query(ElectricityData.id).first() is not None:
+        # Data predates the index; build it once
+        rebuild_availability_index()
+        return availability_etag()
+    return hashlib.sha1(f"{count}|{versions}|{updated_at}".encode()).hexdigest()
+
+
+def load_availability_index(include_days=False):
+    """
+    Serialize the availability index into the /get-available-data catalog.
+
+    Args:
+        include_days: List the days with data in each month instead of ['all']
+
+    Returns:
+        Dictionary of building -> year -> month catalog
+    """
+    rows = DataAvailability.query.order_by(DataAvailability.building, DataAvailability.year).all()
+
+    catalog = {}
+    for row in rows:
+        day_indexes = np.flatnonzero(_day_bits(row.days))
+        if not len(day_indexes):
+            continue
+        first_day = date(row.year, 1, 1).toordinal()
+        months = catalog.setdefault(row.building, {}).setdefault(row.year, {})
+        for day_index in day_indexes:
+            day = date.fromordinal(first_day + int(day_index))
+            if include_days:
+                months.setdefault(day.month, []).append(day.day)
+            else:
+                months.setdefault(day.month, ['all'])
+
+    return catalog
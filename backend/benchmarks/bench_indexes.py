@@ -0,0 +1,130 @@
+"""
+Benchmark the ElectricityData read paths with and without the (building, date) unique key.
+
+Loads a synthetic table (10M rows by default) into a table with no secondary index,
+times the hot queries, adds the unique index and times them again. The query plan
+is printed for each query so the change from a full scan to an index range scan is
+visible. Uses a local SQLite file by default; pass --db to run against MySQL.
+
+Usage:
+    python benchmarks/bench_indexes.py [--rows 10000000] [--buildings 2000] [--db sqlite:///bench_indexes.db]
+"""
+import argparse
+import os
+import statistics
+import time
+from datetime import date, timedelta
+
+from sqlalchemy import Column, Date, Float, Index, Integer, MetaData, String, Table, create_engine, text
+
+QUERIES = {
+    'month of one building': (
+        "SELECT month, date, consumption, building FROM bench_electricity_data "
+        "WHERE date >= :start AND date < :end AND building = :building",
+        lambda start, building: {'start': start, 'end': start + timedelta(days=31), 'building': building}
+    ),
+    'one day of one building': (
+        "SELECT month, date, consumption, building FROM bench_electricity_data "
+        "WHERE date = :start AND building = :building",
+        lambda start, building: {'start': start, 'building': building}
+    ),
+    'year of one building': (
+        "SELECT date, consumption FROM bench_electricity_data "
+        "WHERE building = :building AND date >= :start AND date < :end ORDER BY date",
+        lambda start, building: {'start': start, 'end': start + timedelta(days=365), 'building': building}
+    ),
+}
+
+
+def make_table(metadata):
+    return Table(
+        'bench_electricity_data', metadata,
+        Column('id', Integer, primary_key=True),
+        Column('month', String(20), nullable=False),
+        Column('date', Date, nullable=False),
+        Column('consumption', Float, nullable=False),
+        Column('building', String(50), nullable=False),
+    )
+
+
+def load(engine, table, rows, buildings, batch_size=50000):
+    days = rows // buildings
+    first_day = date(2010, 1, 1)
+    batch = []
+    start = time.perf_counter()
+    with engine.begin() as conn:
+        for day in range(days):
+            current = first_day + timedelta(days=day)
+            month = current.strftime('%B')
+            for building in range(buildings):
+                batch.append({'month': month, 'date': current, 'consumption': float((day * 7 + building) % 500),
+                              'building': f"Building {building}"})
+            if len(batch) >= batch_size:
+                conn.execute(table.insert(), batch)
+                batch = []
+        if batch:
+            conn.execute(table.insert(), batch)
+    print(f"loaded {days * buildings:,} rows in {time.perf_counter() - start:.1f} s")
+    return first_day, days
+
+
+def explain(conn, sql, params):
+    prefix = 'EXPLAIN QUERY PLAN ' if conn.dialect.name == 'sqlite' else 'EXPLAIN '
+    return [' '.join(str(value) for value in row) for row in conn.execute(text(prefix + sql), params)]
+
+
+def time_queries(engine, first_day, days, buildings, repeats):
+    results = {}
+    with engine.connect() as conn:
+        for label, (sql, make_params) in QUERIES.items():
+            samples = []
+            for i in range(repeats):
+                start_day = first_day + timedelta(days=(i * 37) % max(1, days - 365))
+                params = make_params(start_day, f"Building {(i * 13) % buildings}")
+                start = time.perf_counter()
+                conn.execute(text(sql), params).fetchall()
+                samples.append((time.perf_counter() - start) * 1000)
+            results[label] = statistics.median(samples)
+            plan = explain(conn, sql, make_params(first_day, 'Building 0'))
+            print(f"  {label:<26} {results[label]:>10.2f} ms   plan: {' | '.join(plan)}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=10_000_000)
+    parser.add_argument('--buildings', type=int, default=2000)
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--db', default='sqlite:///bench_indexes.db')
+    args = parser.parse_args()
+
+    engine = create_engine(args.db)
+    metadata = MetaData()
+    table = make_table(metadata)
+    metadata.drop_all(engine)
+    metadata.create_all(engine)
+
+    try:
+        first_day, days = load(engine, table, args.rows, args.buildings)
+
+        print("before (primary key only):")
+        before = time_queries(engine, first_day, days, args.buildings, args.repeats)
+
+        start = time.perf_counter()
+        Index('uix_bench_building_date', table.c.building, table.c.date, unique=True).create(engine)
+        print(f"created (building, date) unique index in {time.perf_counter() - start:.1f} s")
+
+        print("after (building, date) unique index:")
+        after = time_queries(engine, first_day, days, args.buildings, args.repeats)
+
+        print("speedup:")
+        for label in QUERIES:
+            print(f"  {label:<26} {before[label] / after[label]:>10.0f}x")
+    finally:
+        metadata.drop_all(engine)
+        if args.db.startswith('sqlite:///') and args.db != 'sqlite:///:memory:':
+            os.remove(args.db[len('sqlite:///'):])
+
+
+if __name__ == '__main__':
+    main()
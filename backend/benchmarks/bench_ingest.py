@@ -0,0 +1,103 @@
+"""
+Benchmark the row-by-row ingestion loop against the bulk ingestion path.
+
+Runs against a local SQLite database by default so it can be executed without
+the RDS instance, and counts the statements sent to the database for each path.
+
+Usage:
+    python benchmarks/bench_ingest.py [--days 365] [--buildings 200] [--db sqlite:///bench.db]
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from sqlalchemy import event
+from models import db, ElectricityData
+from ingest import MONTH_NAMES, bulk_insert_readings
+
+
+def make_app(database_uri):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_uri
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    return app
+
+
+def make_readings(days, start=datetime(2024, 1, 1)):
+    return [(start + timedelta(days=i), 100.0 + (i % 50)) for i in range(days)]
+
+
+def legacy_ingest(building, readings):
+    """Replica of the original parse_csv loop: one SELECT and one add per date column"""
+    for parsed_date, consumption in readings:
+        exists = db.session.query(ElectricityData.id).filter_by(
+            date=parsed_date.date(), building=building
+        ).first() is not None
+        if exists:
+            continue
+        db.session.add(ElectricityData(
+            month=MONTH_NAMES[parsed_date.month],
+            date=parsed_date.date(),
+            consumption=consumption,
+            building=building
+        ))
+    db.session.commit()
+
+
+def bulk_ingest(building, readings):
+    bulk_insert_readings({building: readings})
+    db.session.commit()
+
+
+def campus_ingest(buildings, readings):
+    """Bulk path for one multi-building file: every building row in one duplicate check and insert"""
+    bulk_insert_readings({building: readings for building in buildings})
+    db.session.commit()
+
+
+def run(label, func, building, readings):
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', count)
+    start = time.perf_counter()
+    func(building, readings)
+    elapsed = time.perf_counter() - start
+    event.remove(db.engine, 'before_cursor_execute', count)
+
+    rows = len(readings) * (len(building) if isinstance(building, list) else 1)
+    print(f"{label:<8} {rows:>6} readings  {len(statements):>6} statements  {elapsed * 1000:>9.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--buildings', type=int, default=200, help='building rows in the campus file')
+    parser.add_argument('--db', default='sqlite:///:memory:')
+    args = parser.parse_args()
+
+    app = make_app(args.db)
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        readings = make_readings(args.days)
+        run('legacy', legacy_ingest, 'Building 1', readings)
+        run('bulk', bulk_ingest, 'Building 2', readings)
+        # Re-uploading the same file only costs the duplicate check
+        run('bulk-dup', bulk_ingest, 'Building 2', readings)
+        # One campus export with a row per building
+        campus = [f"Building {1000 + i}" for i in range(args.buildings)]
+        run('campus', campus_ingest, campus, readings)
+        db.drop_all()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""
+Benchmark the /fetch-data payload formats: row dictionaries vs columnar arrays, raw and compressed.
+
+Builds the year-long multi-building pull the dashboards make (one monthly series per
+building per month, as /fetch-batch returns it) and reports the serialized size and
+the time to jsonify, gzip and brotli-compress each format. Needs no database.
+
+Usage:
+    python benchmarks/bench_payload.py [--buildings 50] [--repeats 5]
+"""
+import argparse
+import gzip
+import os
+import statistics
+import sys
+import time
+from datetime import date, timedelta
+
+from flask import Flask, jsonify
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from response_format import BROTLI_QUALITY, GZIP_LEVEL, brotli, to_columnar  # noqa: E402
+
+
+def make_rows(buildings):
+    """Monthly /fetch-data payloads for a year: building -> month -> list of row dictionaries"""
+    payload = {}
+    for building in range(buildings):
+        name = f"Building {100 + building}"
+        months = payload.setdefault(name, {})
+        for day in range(366):
+            current = date(2024, 1, 1) + timedelta(days=day)
+            months.setdefault(current.month, []).append({
+                'month': current.strftime('%B'),
+                'date': current.isoformat(),
+                'consumption': round(1000 + (day * 37 + building * 11) % 500 + building / 7, 2),
+                'building': name
+            })
+    return payload
+
+
+def timed(function, repeats):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function()
+        timings.append((time.perf_counter() - start) * 1000)
+    return result, statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--buildings', type=int, default=50)
+    parser.add_argument('--repeats', type=int, default=5)
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    rows = make_rows(args.buildings)
+    formats = {
+        'rows': lambda: rows,
+        'columnar': lambda: {building: {month: to_columnar(series) for month, series in months.items()}
+                             for building, months in rows.items()},
+    }
+
+    print(f"{args.buildings} buildings x 12 months of daily readings")
+    print(f"{'format':<10} {'json KB':>10} {'json ms':>9} {'gzip KB':>9} {'gzip ms':>9} {'br KB':>8} {'br ms':>8}")
+    with app.app_context():
+        for label, build in formats.items():
+            body, json_ms = timed(lambda: jsonify(build()).get_data(), args.repeats)
+            gzipped, gzip_ms = timed(lambda: gzip.compress(body, compresslevel=GZIP_LEVEL), args.repeats)
+            line = f"{label:<10} {len(body) / 1024:>10.0f} {json_ms:>9.1f} {len(gzipped) / 1024:>9.0f} {gzip_ms:>9.1f}"
+            if brotli is not None:
+                compressed, br_ms = timed(lambda: brotli.compress(body, quality=BROTLI_QUALITY), args.repeats)
+                line += f" {len(compressed) / 1024:>8.0f} {br_ms:>8.1f}"
+            print(line)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,40 @@
+from sqlalchemy import insert
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from models import db
+
+
+def upsert(model, index_elements, update_columns=()):
+    """
+    Build a dialect-specific INSERT that resolves unique-key conflicts in the database.
+
+    Rows that collide with an existing row on index_elements get update_columns
+    overwritten with the new values; with no update_columns they are skipped.
+    Execute with db.session.execute(statement, rows).
+
+    Args:
+        model: Model class to insert into
+        index_elements: Column names of the unique constraint rows may collide on
+        update_columns: Column names to overwrite on conflict
+
+    Returns:
+        An executable INSERT statement
+    """
+    dialect = db.session.get_bind().dialect.name
+
+    if dialect == 'mysql':
+        statement = mysql.insert(model)
+        if update_columns:
+            return statement.on_duplicate_key_update({column: statement.inserted[column] for column in update_columns})
+        # No-op assignment so duplicates are skipped without INSERT IGNORE hiding other errors
+        return statement.on_duplicate_key_update({index_elements[0]: statement.inserted[index_elements[0]]})
+
+    if dialect in ('postgresql', 'sqlite'):
+        statement = (postgresql if dialect == 'postgresql' else sqlite).insert(model)
+        if update_columns:
+            return statement.on_conflict_do_update(
+                index_elements=list(index_elements),
+                set_={column: statement.excluded[column] for column in update_columns}
+            )
+        return statement.on_conflict_do_nothing(index_elements=list(index_elements))
+
+    return insert(model)
@@ -0,0 +1,687 @@
+import functools
+import os
+import pickle
+import stat
+import tempfile
+import threading
+import time
+import zlib
+from abc import ABC, abstractmethod
+from collections import Counter, OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from fnmatch import fnmatchcase
+from urllib.parse import quote, unquote
+
+
+def ensure_private_directory(directory):
+    """
+    Create directory readable only by this user, or check that an existing one is safe.
+
+    Cache files are unpickled and spooled uploads are ingested, so anyone who can write to
+    the directory can run code in or write data through the app. Directories other users
+    can write to, or that another user owns, are refused.
+
+    Raises:
+        PermissionError: If the directory is group or world writable or not owned by this user
+    """
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    info = os.stat(directory)
+    if not stat.S_ISDIR(info.st_mode):
+        raise NotADirectoryError(directory)
+    if hasattr(os, 'getuid') and info.st_uid != os.getuid():
+        raise PermissionError(f"Directory {directory} is owned by another user")
+    if info.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+        raise PermissionError(f"Directory {directory} is writable by other users")
+    return directory
+
+
+class CacheBackend(ABC):
+    """
+    Storage interface behind ConsumptionCache.
+
+    Backends store opaque entries by key and know nothing about expiry; entries are
+    (stored_at, timeout, value) tuples built by ConsumptionCache.
+    """
+
+    # Called with each key the backend evicts to stay within its budget
+    on_evict = None
+
+    @abstractmethod
+    def get(self, key):
+        """Return the stored entry, or None"""
+
+    @abstractmethod
+    def set(self, key, entry, retention=None):
+        """Store an entry; retention is how many seconds it is needed, for backends that expire on their own"""
+
+    @abstractmethod
+    def delete(self, key):
+        """Remove an entry if it exists"""
+
+    @abstractmethod
+    def keys(self):
+        """List the stored keys"""
+
+    def clear(self):
+        for key in self.keys():
+            self.delete(key)
+
+
+class MemoryBackend(CacheBackend):
+    """
+    In-process store with a byte budget and least-recently-used eviction.
+
+    Entries are sized by their pickled payload, so a year of statistics costs more
+    of the budget than a single day's reading.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._max_bytes = max_bytes
+        self._size = 0
+
+    def get(self, key):
+        with self._lock:
+            payload = self._entries.get(key)
+            if payload is not None:
+                self._entries.move_to_end(key)
+        # Entries are pickled so callers can't mutate what is cached
+        return pickle.loads(payload) if payload is not None else None
+
+    def set(self, key, entry, retention=None):
+        self._store(key, pickle.dumps(entry, pickle.HIGHEST_PROTOCOL))
+
+    def _store(self, key, payload):
+        evicted = []
+        with self._lock:
+            self._remove(key)
+            if len(payload) > self._max_bytes:
+                return
+            self._entries[key] = payload
+            self._size += len(payload)
+            while self._size > self._max_bytes:
+                evicted_key, _ = next(iter(self._entries.items()))
+                self._remove(evicted_key)
+                evicted.append(evicted_key)
+        for evicted_key in evicted:
+            if self.on_evict:
+                self.on_evict(evicted_key)
+
+    def delete(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def keys(self):
+        with self._lock:
+            return list(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def size(self):
+        """Bytes currently used by cached payloads"""
+        return self._size
+
+    def items(self):
+        """(key, pickled entry) pairs from least to most recently used"""
+        with self._lock:
+            return list(self._entries.items())
+
+    def restore(self, items):
+        """Put back (key, pickled entry) pairs from items(), keeping their recency order"""
+        for key, payload in items:
+            self._store(key, payload)
+
+    def _remove(self, key):
+        payload = self._entries.pop(key, None)
+        if payload is not None:
+            self._size -= len(payload)
+
+
+class FileSystemBackend(CacheBackend):
+    """
+    Store shared by every worker on the host: one pickle file per key in a directory.
+
+    File names are the percent-encoded keys, so keys can be listed back without an index.
+    The directory must be private to this user (see ensure_private_directory).
+    Writes go to a temporary file first and are moved into place atomically. Reads
+    touch the file, so pruning by modification time evicts the least recently used
+    entries once the directory exceeds its byte budget.
+
+    Scanning the directory costs one stat per entry, so writes only add to a running
+    size estimate; the directory is scanned and pruned when the estimate goes over
+    budget, or every PRUNE_INTERVAL writes to pick up what other workers wrote.
+    """
+
+    SUFFIX = '.cache'
+
+    # Writes between directory scans when the estimate stays within budget
+    PRUNE_INTERVAL = 100
+
+    def __init__(self, directory, max_bytes=256 * 1024 * 1024):
+        self._directory = directory
+        self._max_bytes = max_bytes
+        self._size_estimate = None  # Unknown until the first scan
+        self._writes_since_scan = 0
+        self._size_lock = threading.Lock()
+        ensure_private_directory(directory)
+
+    def _path(self, key):
+        return os.path.join(self._directory, quote(key, safe='') + self.SUFFIX)
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                entry = pickle.load(f)
+            os.utime(path)
+            return entry
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            return None
+
+    def set(self, key, entry, retention=None):
+        fd, tmp_path = tempfile.mkstemp(dir=self._directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(entry, f, pickle.HIGHEST_PROTOCOL)
+                written = f.tell()
+            os.replace(tmp_path, self._path(key))
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        # Replaced files are counted twice, which only brings the next scan forward
+        with self._size_lock:
+            self._writes_since_scan += 1
+            if self._size_estimate is not None:
+                self._size_estimate += written
+            due = (self._size_estimate is None or self._size_estimate > self._max_bytes
+                   or self._writes_since_scan >= self.PRUNE_INTERVAL)
+        if due:
+            self._prune()
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def keys(self):
+        return [unquote(name[:-len(self.SUFFIX)]) for name in os.listdir(self._directory) if name.endswith(self.SUFFIX)]
+
+    def _prune(self):
+        """Remove the least recently used files while the directory is over budget"""
+        files = []
+        for entry in os.scandir(self._directory):
+            if entry.name.endswith(self.SUFFIX):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, entry.path, entry.name))
+        total = sum(size for _, size, _, _ in files)
+        if total > self._max_bytes:
+            for _, size, path, name in sorted(files):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    continue
+                total -= size
+                if self.on_evict:
+                    self.on_evict(unquote(name[:-len(self.SUFFIX)]))
+                if total <= self._max_bytes:
+                    break
+
+        with self._size_lock:
+            self._size_estimate = total
+            self._writes_since_scan = 0
+
+
+class RedisBackend(CacheBackend):
+    """Store on a Redis server (or any server speaking the Redis protocol)"""
+
+    def __init__(self, url, prefix='electricity_cache:'):
+        import redis  # Optional dependency, only needed for this backend
+        self._client = redis.Redis.from_url(url)
+        self._prefix = prefix
+
+    def get(self, key):
+        payload = self._client.get(self._prefix + key)
+        return pickle.loads(payload) if payload is not None else None
+
+    def set(self, key, entry, retention=None):
+        payload = pickle.dumps(entry, pickle.HIGHEST_PROTOCOL)
+        # Let Redis drop entries once they are past their stale window
+        self._client.set(self._prefix + key, payload, ex=int(retention) + 1 if retention else None)
+
+    def delete(self, key):
+        self._client.delete(self._prefix + key)
+
+    def keys(self):
+        return [key.decode()[len(self._prefix):] for key in self._client.scan_iter(match=self._prefix + '*')]
+
+
+class ConsumptionCache:
+    """
+    Cache for consumption data and statistics with a pluggable storage backend.
+
+    Args:
+        backend: CacheBackend instance
+        default_timeout: Seconds an entry stays fresh (0 keeps it until evicted)
+        max_staleness: Seconds past expiry an entry may still be served while it is
+            refreshed in the background (stale-while-revalidate)
+    """
+
+    def __init__(self, backend, default_timeout=3600, max_staleness=0):
+        self.backend = backend
+        self.default_timeout = default_timeout
+        self.max_staleness = max_staleness
+        self._counters = defaultdict(lambda: {'hits': 0, 'misses': 0, 'stale': 0, 'evictions': 0, 'coalesced': 0})
+        self._counters_lock = threading.Lock()
+        self._in_flight = {}
+        self._in_flight_lock = threading.Lock()
+        self._revalidating = set()
+        self._revalidate_pool = None
+        self._access_counts = Counter()
+        self._access_params = {}
+        self._access_lock = threading.Lock()
+        backend.on_evict = lambda key: self._count(key, 'evictions')
+
+    def _lookup(self, key):
+        """Return (value, age in seconds, 'fresh' or 'stale'), or (None, None, None) on a miss"""
+        entry = self.backend.get(key)
+        if entry is None:
+            return None, None, None
+        stored_at, timeout, value = entry
+        age = time.time() - stored_at
+        if not timeout or age <= timeout:
+            return value, age, 'fresh'
+        if age <= timeout + self.max_staleness:
+            return value, age, 'stale'
+        self.backend.delete(key)
+        return None, None, None
+
+    def get(self, key):
+        """Return the cached value, or None if it is missing or expired"""
+        value, _, state = self._lookup(key)
+        if state != 'fresh':
+            self._count(key, 'misses')
+            return None
+        self._count(key, 'hits')
+        return value
+
+    def get_or_load(self, key, loader, background_loader=None):
+        """Return the cached value, calling loader() to fill it on a miss (see get_or_load_with_age)"""
+        return self.get_or_load_with_age(key, loader, background_loader)[0]
+
+    def get_or_load_with_age(self, key, loader, background_loader=None):
+        """
+        Return the cached value, calling loader() to fill it on a miss.
+
+        Concurrent misses on the same key in this process share a single loader call:
+        the first caller loads while the others wait for its result (single flight).
+        An expired entry still within max_staleness is returned immediately and
+        background_loader() refreshes it on a worker thread, once per key; without a
+        background_loader it counts as a miss. None results are returned but not cached.
+
+        Returns:
+            Tuple of (value, age of the value in seconds, 'hit', 'stale' or 'miss')
+        """
+        value, age, state = self._lookup(key)
+        if state == 'fresh':
+            self._count(key, 'hits')
+            return value, age, 'hit'
+        if state == 'stale' and background_loader is not None:
+            self._count(key, 'stale')
+            self._revalidate(key, background_loader)
+            return value, age, 'stale'
+
+        self._count(key, 'misses')
+        return self._load_once(key, loader), 0.0, 'miss'
+
+    def get_or_load_many(self, keys, loader, background_loader=None):
+        """
+        Look up several keys at once, loading all the misses with a single loader call.
+
+        Behaves like get_or_load_with_age for each key: misses take part in the same
+        single flight as single-key lookups, and stale entries are served while
+        background_loader(key) refreshes them.
+
+        Args:
+            keys: Cache keys
+            loader: Called with the list of keys to load; returns a dictionary of
+                key -> value, where missing keys count as None
+            background_loader: Called with one stale key on a worker thread
+
+        Returns:
+            Dictionary of key -> (value, age in seconds, 'hit', 'stale' or 'miss')
+        """
+        results = {}
+        missing = []
+        for key in dict.fromkeys(keys):
+            value, age, state = self._lookup(key)
+            if state == 'fresh':
+                self._count(key, 'hits')
+                results[key] = (value, age, 'hit')
+            elif state == 'stale' and background_loader is not None:
+                self._count(key, 'stale')
+                self._revalidate(key, functools.partial(background_loader, key))
+                results[key] = (value, age, 'stale')
+            else:
+                self._count(key, 'misses')
+                missing.append(key)
+
+        if missing:
+            for key, value in self._load_many_once(missing, loader).items():
+                results[key] = (value, 0.0, 'miss')
+        return results
+
+    def _load_once(self, key, loader):
+        return self._load_many_once([key], lambda keys: {key: loader()})[key]
+
+    def _load_many_once(self, keys, loader):
+        """
+        Load keys with one loader call, sharing the work with concurrent callers (single flight).
+
+        Keys nobody is loading yet are led by this call; keys another caller is already
+        loading are waited for. The led keys are finished before waiting on others, so two
+        batches that overlap cannot wait on each other.
+        """
+        leading, following = {}, {}
+        with self._in_flight_lock:
+            for key in keys:
+                flight = self._in_flight.get(key)
+                if flight is None:
+                    leading[key] = self._in_flight[key] = {'done': threading.Event(), 'value': None, 'error': None}
+                else:
+                    following[key] = flight
+
+        values = {}
+        try:
+            to_load = []
+            for key in leading:
+                # A caller that missed just before the previous leader stored its value only gets
+                # here after that flight ended, so the value is visible now and is not loaded again
+                value, _, state = self._lookup(key)
+                if state == 'fresh':
+                    self._count(key, 'coalesced')
+                    values[key] = value
+                else:
+                    to_load.append(key)
+
+            if to_load:
+                loaded = loader(to_load)
+                for key in to_load:
+                    values[key] = loaded.get(key)
+                    if values[key] is not None:
+                        # Published before the flight ends, so later callers find it in the cache
+                        self.set(key, values[key])
+            for key, flight in leading.items():
+                flight['value'] = values[key]
+        except Exception as e:
+            for flight in leading.values():
+                flight['error'] = e
+            raise
+        finally:
+            with self._in_flight_lock:
+                for key in leading:
+                    del self._in_flight[key]
+            for flight in leading.values():
+                flight['done'].set()
+
+        for key, flight in following.items():
+            self._count(key, 'coalesced')
+            flight['done'].wait()
+            if flight['error'] is not None:
+                raise flight['error']
+            values[key] = flight['value']
+        return values
+
+    def _revalidate(self, key, background_loader):
+        """Refresh a stale key on a background thread unless a refresh is already running"""
+        with self._in_flight_lock:
+            if key in self._revalidating:
+                return
+            self._revalidating.add(key)
+            if self._revalidate_pool is None:
+                self._revalidate_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix='cache-revalidate')
+
+        def refresh():
+            try:
+                value = background_loader()
+                if value is not None:
+                    self.set(key, value)
+            except Exception as e:
+                print(f"Error revalidating cache key {key}: {e}")
+            finally:
+                with self._in_flight_lock:
+                    self._revalidating.discard(key)
+
+        self._revalidate_pool.submit(refresh)
+
+    def set(self, key, value, timeout=None):
+        timeout = self.default_timeout if timeout is None else timeout
+        # Keep the entry around for its stale window too
+        retention = timeout + self.max_staleness if timeout else None
+        self.backend.set(key, (time.time(), timeout, value), retention)
+
+    def delete(self, key):
+        self.backend.delete(key)
+
+    def keys(self, pattern=None):
+        """List cached keys, optionally filtered by a shell-style pattern such as 'electricity_stats_*'"""
+        keys = self.backend.keys()
+        if pattern is not None:
+            keys = [key for key in keys if fnmatchcase(key, pattern)]
+        return sorted(keys)
+
+    def delete_matching(self, patterns):
+        """
+        Delete every key matching any of the shell-style patterns.
+
+        Returns:
+            List of deleted keys
+        """
+        return self.delete_where(lambda key: any(fnmatchcase(key, pattern) for pattern in patterns))
+
+    def delete_where(self, predicate):
+        """
+        Delete every key for which predicate(key) is true, listing the keys once.
+
+        Returns:
+            List of deleted keys
+        """
+        deleted = [key for key in self.backend.keys() if predicate(key)]
+        for key in deleted:
+            self.backend.delete(key)
+        return deleted
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        """Hit, miss, stale, eviction and coalesced-miss counters for each key family seen by this process"""
+        with self._counters_lock:
+            stats = {family: dict(counters) for family, counters in self._counters.items()}
+        for counters in stats.values():
+            lookups = counters['hits'] + counters['misses']
+            counters['hit_rate'] = round(counters['hits'] / lookups, 3) if lookups else None
+        return stats
+
+    def record_access(self, key, params):
+        """Count a request for key; params are what is needed to reload it when warming"""
+        with self._access_lock:
+            self._access_counts[key] += 1
+            self._access_params[key] = params
+
+    def most_accessed(self, limit):
+        """
+        Return the limit most requested (key, params) pairs, then halve every count.
+
+        Halving on each call makes the ranking favour recent demand over old history.
+        """
+        with self._access_lock:
+            ranked = [(key, self._access_params[key]) for key, _ in self._access_counts.most_common(limit)]
+            self._access_counts = Counter({
+                key: count // 2 for key, count in self._access_counts.items() if count // 2
+            })
+            self._access_params = {key: self._access_params[key] for key in self._access_counts}
+        return ranked
+
+    def save_snapshot(self, path):
+        """
+        Write the cached entries and access counts to path as zlib-compressed pickle.
+
+        Only the memory backend needs this; the filesystem and Redis backends already
+        outlive the process. The file is replaced atomically, and an empty cache does not
+        overwrite an earlier snapshot.
+
+        Returns:
+            Number of entries written
+        """
+        if not isinstance(self.backend, MemoryBackend):
+            return 0
+        items = self.backend.items()
+        with self._access_lock:
+            access = {key: (count, self._access_params[key]) for key, count in self._access_counts.items()}
+        if not items and not access:
+            return 0
+
+        payload = SNAPSHOT_MAGIC + zlib.compress(pickle.dumps({'entries': items, 'access': access}, pickle.HIGHEST_PROTOCOL))
+        directory = ensure_private_directory(os.path.dirname(os.path.abspath(path)))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(payload)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return len(items)
+
+    def load_snapshot(self, path):
+        """
+        Restore entries and access counts written by save_snapshot.
+
+        Entries keep their original store time, so anything past its stale window is
+        dropped instead of being served. A missing or unreadable file is ignored.
+
+        Returns:
+            Number of entries restored
+
+        Raises:
+            PermissionError: If other users could have written the snapshot, which is unpickled
+        """
+        if not isinstance(self.backend, MemoryBackend):
+            return 0
+        ensure_private_directory(os.path.dirname(os.path.abspath(path)))
+        try:
+            info = os.stat(path)
+        except FileNotFoundError:
+            return 0
+        if (hasattr(os, 'getuid') and info.st_uid != os.getuid()) or info.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+            raise PermissionError(f"Cache snapshot {path} is writable by or owned by another user")
+        try:
+            with open(path, 'rb') as f:
+                payload = f.read()
+            if not payload.startswith(SNAPSHOT_MAGIC):
+                return 0
+            snapshot = pickle.loads(zlib.decompress(payload[len(SNAPSHOT_MAGIC):]))
+        except (OSError, zlib.error, pickle.UnpicklingError, EOFError):
+            return 0
+
+        now = time.time()
+        live = []
+        for key, entry_payload in snapshot['entries']:
+            stored_at, timeout, _ = pickle.loads(entry_payload)
+            if not timeout or now - stored_at <= timeout + self.max_staleness:
+                live.append((key, entry_payload))
+        self.backend.restore(live)
+
+        with self._access_lock:
+            for key, (count, params) in snapshot['access'].items():
+                self._access_counts[key] += count
+                self._access_params.setdefault(key, params)
+        return len(live)
+
+    def _count(self, key, counter):
+        with self._counters_lock:
+            self._counters[key_family(key)][counter] += 1
+
+
+# Leading bytes of a snapshot file, bumped if its layout changes
+SNAPSHOT_MAGIC = b'ETCACHE1'
+
+
+def key_family(key):
+    """Group cache keys into the families counters are kept for: data, stats, range or other"""
+    if key.startswith('electricity_data_'):
+        return 'data'
+    if key.startswith('electricity_stats_'):
+        return 'stats'
+    if key.startswith('electricity_range_'):
+        return 'range'
+    return 'other'
+
+
+def period_key_matcher(periods):
+    """
+    Build a predicate telling whether a cache key depends on any (building, year, month) period.
+
+    Keys are electricity_<family>_<year>_<month>_<day or all>_<building> for data and
+    stats, and electricity_range_<start>_<end>_<resolution>_<max points>_<building> for
+    ranges, with spaces in the building replaced by underscores. Each key is split once
+    and checked with set lookups, so the cost does not grow with the number of periods.
+    Data and stats keys depend on their own month, yearly statistics (any month, day
+    'all') on every month of their year, and date ranges on every month of the building.
+    """
+    months = {(building.replace(' ', '_'), str(year), str(month)) for building, year, month in periods}
+    years = {(building, year) for building, year, _ in months}
+    buildings = {building for building, _, _ in months}
+
+    def depends_on_periods(key):
+        parts = key.split('_', 5)
+        if len(parts) < 6 or parts[0] != 'electricity':
+            return False
+        _, family, year, month, day, building = parts
+        if family == 'range':
+            parts = key.split('_', 6)
+            return len(parts) == 7 and parts[6] in buildings
+        if family == 'data':
+            return (building, year, month) in months
+        if family == 'stats':
+            return (building, year, month) in months or (day == 'all' and (building, year) in years)
+        return False
+
+    return depends_on_periods
+
+
+def create_cache(config):
+    """
+    Build the ConsumptionCache described by the Flask config.
+
+    CACHE_BACKEND selects 'memory' (default, per process), 'filesystem' (CACHE_DIR, a
+    directory private to the app's user, shared by all workers on the host) or 'redis'
+    (CACHE_REDIS_URL). CACHE_MAX_BYTES is the byte budget of the memory and filesystem
+    backends.
+    """
+    backend_name = config.get('CACHE_BACKEND', 'memory')
+    max_bytes = config.get('CACHE_MAX_BYTES', 64 * 1024 * 1024)
+
+    if backend_name == 'memory':
+        backend = MemoryBackend(max_bytes)
+    elif backend_name == 'filesystem':
+        if not config.get('CACHE_DIR'):
+            raise ValueError("CACHE_DIR must be set for the filesystem cache backend")
+        backend = FileSystemBackend(config['CACHE_DIR'], max_bytes)
+    elif backend_name == 'redis':
+        backend = RedisBackend(config.get('CACHE_REDIS_URL', 'redis://localhost:6379/0'))
+    else:
+        raise ValueError(f"Unsupported cache backend: {backend_name}")
+
+    return ConsumptionCache(backend, config.get('CACHE_DEFAULT_TIMEOUT', 3600), config.get('CACHE_MAX_STALENESS', 0))
@@ -0,0 +1,415 @@
+import atexit
+import codecs
+import contextlib
+import multiprocessing
+import os
+import re
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import pandas as pd
+from availability import mark_days_available
+from bulk_sql import upsert
+from models import db, ElectricityData
+from monthly_stats import MONTH_NAMES, refresh_monthly_statistics
+from online_anomaly import score_new_readings
+
+# Number of processes used to parse uploaded files (None lets Python pick one per CPU)
+PARSE_WORKERS = int(os.environ['INGEST_PARSE_WORKERS']) if os.environ.get('INGEST_PARSE_WORKERS') else None
+
+# Number of parsed files written per database transaction
+WRITE_BATCH_SIZE = 10
+
+# Columns parsed at a time when streaming wide meter exports
+CHUNK_COLUMNS = 4096
+
+# Characters read from an upload at a time
+READ_BLOCK_SIZE = 1 << 16
+
+# Timestamp format of the header columns
+DATE_FORMAT = '%m/%d/%Y %H:%M'
+
+_parse_pool = None
+_parse_pool_lock = threading.Lock()
+
+
+@contextlib.contextmanager
+def _open_text(file):
+    """Text stream for a path, a text stream or a binary file object; closes only files it opened"""
+    if isinstance(file, (str, os.PathLike)):
+        with open(file, encoding='utf-8-sig', newline='') as stream:
+            yield stream
+    elif isinstance(file.read(0), bytes):
+        yield codecs.getreader('utf-8-sig')(file)
+    else:
+        yield file
+
+
+def _iter_field_chunks(stream, chunk_columns=CHUNK_COLUMNS):
+    """
+    Split a CSV stream into chunks of at most chunk_columns fields without holding a whole row.
+
+    The stream is read READ_BLOCK_SIZE characters at a time. Fields may be quoted but must
+    not contain commas or line breaks, which holds for meter exports.
+
+    Yields:
+        (row_number, fields, row_complete) tuples
+    """
+    row_number = 0
+    fields = []
+    carry = ''
+    # Whether the current row has already had fields before its final segment, so a row
+    # whose last field is empty is not mistaken for a blank line
+    row_started = False
+
+    def flush(row_complete):
+        nonlocal fields
+        while len(fields) >= chunk_columns:
+            chunk, fields = fields[:chunk_columns], fields[chunk_columns:]
+            yield row_number, [field.strip('\r"\ufeff ') for field in chunk], row_complete and not fields
+        if row_complete and fields:
+            chunk, fields = fields, []
+            yield row_number, [field.strip('\r"\ufeff ') for field in chunk], True
+
+    while True:
+        block = stream.read(READ_BLOCK_SIZE)
+        if not block:
+            break
+        text = carry + block
+        # Hold back the trailing partial field until the next block arrives
+        cut = max(text.rfind(','), text.rfind('\n'))
+        if cut < 0:
+            carry = text
+            continue
+        body, carry = text[:cut + 1], text[cut + 1:]
+
+        segments = body.split('\n')
+        for index, segment in enumerate(segments):
+            if index < len(segments) - 1:
+                # Segment ends a row
+                fields.extend(segment.split(','))
+                if row_started or (fields != [''] and fields != ['\r']):
+                    yield from flush(True)
+                    row_number += 1
+                fields = []
+                row_started = False
+            elif segment:
+                # Segment ends with a comma, so its last split piece is empty
+                fields.extend(segment.split(',')[:-1])
+                row_started = True
+                yield from flush(False)
+
+    if carry or fields or row_started:
+        fields.append(carry)
+        if row_started or (fields != [''] and fields != ['\r']):
+            yield from flush(True)
+
+
+def iter_meter_chunks(file, chunk_columns=CHUNK_COLUMNS):
+    """
+    Stream a meter export as (building, timestamps, consumption) chunks, one building per row.
+
+    The header is parsed with one vectorized to_datetime call per chunk and kept as a
+    datetime64 array; values are never materialised as a full row or DataFrame.
+
+    Args:
+        file: Path, file object or buffer holding the CSV export
+        chunk_columns: Maximum number of columns handled at once
+
+    Yields:
+        (building, numpy datetime64 array, numpy float array) tuples
+    """
+    with _open_text(file) as stream:
+        yield from _iter_rows(stream, chunk_columns)
+
+
+def _iter_rows(stream, chunk_columns):
+    """Body of iter_meter_chunks over an open text stream"""
+    header_chunks = []
+    header_dates = None
+    building = None
+    current_row = 0
+    position = 0  # Column index of the first field in the current chunk
+    offset = 0  # Date column index of the first value in the current chunk
+
+    for row_number, fields, row_complete in _iter_field_chunks(stream, chunk_columns):
+        if row_number != current_row:
+            current_row, position, offset = row_number, 0, 0
+
+        if position == 0:
+            if row_number == 0 and fields[0] != 'Group':
+                raise ValueError("Expected a 'Group' column first in the file")
+            if row_number > 0:
+                # Each data row is one building
+                match = re.search(r'Building\s(\d+)', fields[0])
+                if match is None:
+                    raise ValueError(f"Row {row_number}: no building number in '{fields[0]}'")
+                building = f"Building {match.group(1)}"
+
+        # The first two columns ('Group' and the unit) are not part of the date-based data
+        skip = max(0, 2 - position)
+        position += len(fields)
+        fields = fields[skip:]
+
+        if row_number == 0:
+            header_chunks.append(pd.to_datetime(pd.Series(fields, dtype=object), format=DATE_FORMAT).to_numpy())
+            if row_complete:
+                header_dates = np.concatenate(header_chunks)
+            continue
+
+        values = pd.to_numeric(pd.Series(fields, dtype=object), errors='coerce').to_numpy(dtype=float)
+        dates = header_dates[offset:offset + len(values)]
+        # Fields past the end of the header (such as a trailing comma) have no date
+        values = values[:len(dates)]
+        offset += len(values)
+        yield building, dates, values
+
+
+def parse_meter_csv(file):
+    """
+    Parse a meter export into readings for every building row in it.
+
+    Does not touch the database, so it can run in a worker process. The file is streamed
+    in chunks and reduced to the first reading of each day as it is read, so memory does
+    not grow with the number of interval columns.
+
+    Args:
+        file: Path, file object or buffer holding the CSV export
+
+    Returns:
+        Dictionary with 'readings' mapping building -> list of (datetime, consumption)
+        tuples, or None if the file has no valid consumption data
+    """
+    first_per_day = {}
+    has_consumption = False
+
+    for building, dates, values in iter_meter_chunks(file):
+        # Skip missing readings
+        valid = ~np.isnan(values)
+        dates, values = dates[valid], values[valid]
+        has_consumption = has_consumption or bool(np.any(values))
+
+        # Keep the first reading of each day, like the duplicate check on insert
+        days, first_index = np.unique(dates.astype('datetime64[D]'), return_index=True)
+        building_days = first_per_day.setdefault(building, {})
+        for day, timestamp, value in zip(days, dates[first_index], values[first_index]):
+            if day not in building_days:
+                building_days[day] = (pd.Timestamp(timestamp).to_pydatetime(), float(value))
+
+    # Check for empty consumption data
+    if not has_consumption:
+        return None
+
+    return {'readings': {building: sorted(building_days.values()) for building, building_days in first_per_day.items()}}
+
+
+def _timed_parse(path):
+    """Process pool entry point: parse a spooled upload and report how long it took"""
+    start = time.perf_counter()
+    parsed = parse_meter_csv(path)
+    return parsed, (time.perf_counter() - start) * 1000
+
+
+def _get_parse_pool():
+    """
+    Create the parse pool on first use.
+
+    Workers are started with forkserver (spawn where it is unavailable) rather than
+    forked, since the Flask process has threads and open database connections.
+    """
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is None:
+            method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            _parse_pool = ProcessPoolExecutor(max_workers=PARSE_WORKERS, mp_context=multiprocessing.get_context(method))
+            atexit.register(_shutdown_parse_pool)
+    return _parse_pool
+
+
+def _shutdown_parse_pool():
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is not None:
+            _parse_pool.shutdown(wait=False, cancel_futures=True)
+            _parse_pool = None
+
+
+def write_parsed_file(parsed):
+    """
+    Write one parsed file's new readings, refresh its monthly statistics and score it for anomalies (caller commits).
+
+    Returns:
+        Dictionary with the last month name in the file, the new consumption values per
+        month name, the buildings in the file, the (building, year, month) keys that got
+        new rows, the number of rows written and duplicates skipped, and the number of
+        anomalies the online detector flagged
+    """
+    readings = parsed['readings']
+
+    # Input new data for every building with one duplicate check and one multi-row insert
+    new_rows = bulk_insert_readings(readings)
+
+    # Collect monthly consumption data
+    monthly_consumption_data = {}
+    for row in new_rows:
+        monthly_consumption_data.setdefault(row['month'], []).append(row['consumption'])
+
+    # Record the new days in the availability index
+    mark_days_available((row['building'], row['date']) for row in new_rows)
+
+    # Recompute statistics for every (building, month) that received new rows
+    refresh_monthly_statistics({(row['building'], row['date'].replace(day=1)) for row in new_rows})
+
+    # Score the new rows against each building's running statistics
+    anomalies = score_new_readings(new_rows)
+
+    last_reading = max(building_readings[-1][0] for building_readings in readings.values())
+    total_days = sum(len(building_readings) for building_readings in readings.values())
+    return {
+        'month': MONTH_NAMES[last_reading.month],
+        'data': monthly_consumption_data,
+        'buildings': sorted(readings),
+        'months': sorted({(row['building'], row['date'].year, row['date'].month) for row in new_rows}),
+        'rows_written': len(new_rows),
+        'duplicates_skipped': total_days - len(new_rows),
+        'anomalies': len(anomalies)
+    }
+
+
+def _iter_parsed(uploads):
+    """Yield (index, parsed, parse_ms, error) tuples as uploaded files finish parsing"""
+    if len(uploads) == 1:
+        # Not worth a round trip through the pool
+        try:
+            outcome = (0, *_timed_parse(uploads[0][1]), None)
+        except Exception as e:
+            outcome = (0, None, 0.0, e)
+        yield outcome
+        return
+
+    pool = _get_parse_pool()
+    futures = {pool.submit(_timed_parse, path): index for index, (_, path) in enumerate(uploads)}
+    for future in as_completed(futures):
+        try:
+            outcome = (futures[future], *future.result(), None)
+        except Exception as e:
+            outcome = (futures[future], None, 0.0, e)
+        yield outcome
+
+
+def ingest_files(uploads, progress=None):
+    """
+    Parse uploaded files concurrently in a process pool and write them through one writer.
+
+    Files are written in completion order by the calling thread, each inside its own
+    savepoint so one bad file does not undo the others, and committed in batches of
+    WRITE_BATCH_SIZE files. Workers are handed file paths and stream the files
+    themselves, so file contents are never held in memory or pickled between processes.
+
+    Args:
+        uploads: List of (filename, path) tuples
+        progress: Optional callback called with each file's result once it is written
+
+    Returns:
+        Tuple of (per-file result list in upload order, timing dictionary)
+    """
+    results = [None] * len(uploads)
+    timing = {'parse_ms': 0.0, 'write_ms': 0.0}
+    start = time.perf_counter()
+
+    pending = 0
+    for index, parsed, parse_ms, error in _iter_parsed(uploads):
+        filename = uploads[index][0]
+        timing['parse_ms'] += parse_ms
+        if error is not None or parsed is None:
+            message = f"Error processing file: {str(error)}" if error is not None else "No valid consumption data found in the file."
+            results[index] = {'filename': filename, 'error': message}
+            if progress:
+                progress(results[index])
+            continue
+
+        write_start = time.perf_counter()
+        try:
+            with db.session.begin_nested():
+                written = write_parsed_file(parsed)
+            results[index] = {'filename': filename, **written, 'parse_ms': round(parse_ms, 1)}
+        except Exception as e:
+            results[index] = {'filename': filename, 'error': f"Error processing file: {str(e)}"}
+        pending += 1
+        if pending >= WRITE_BATCH_SIZE:
+            db.session.commit()
+            pending = 0
+        write_ms = (time.perf_counter() - write_start) * 1000
+        results[index]['write_ms'] = round(write_ms, 1)
+        timing['write_ms'] += write_ms
+        if progress:
+            progress(results[index])
+
+    write_start = time.perf_counter()
+    db.session.commit()
+    timing['write_ms'] += (time.perf_counter() - write_start) * 1000
+
+    timing = {key: round(value, 1) for key, value in timing.items()}
+    timing['total_ms'] = round((time.perf_counter() - start) * 1000, 1)
+    return results, timing
+
+
+def find_existing_pairs(buildings, start_date, end_date):
+    """Return the (building, date) pairs that already have a reading in the range (one query)"""
+    if not buildings:
+        return set()
+
+    rows = db.session.query(ElectricityData.building, ElectricityData.date).filter(
+        ElectricityData.building.in_(list(buildings)),
+        ElectricityData.date >= start_date,
+        ElectricityData.date <= end_date
+    ).all()
+    return {(building, date) for building, date in rows}
+
+
+def bulk_insert_readings(readings):
+    """
+    Insert the readings that are not in the database yet with a single multi-row INSERT.
+
+    Args:
+        readings: Dictionary of building name -> list of (datetime, consumption) tuples
+
+    Returns:
+        List of row dictionaries this call actually inserted; rows a concurrent upload
+        wrote first are left out
+    """
+    # Only the first reading of each day is stored, like the row-by-row path did
+    first_per_day = {}
+    for building, building_readings in readings.items():
+        for parsed_date, consumption in building_readings:
+            first_per_day.setdefault((building, parsed_date.date()), consumption)
+
+    if not first_per_day:
+        return []
+
+    dates = [date for _, date in first_per_day]
+    existing = find_existing_pairs(readings.keys(), min(dates), max(dates))
+
+    rows = [{
+        'month': MONTH_NAMES[date.month],
+        'date': date,
+        'consumption': float(consumption),
+        'building': building
+    } for (building, date), consumption in first_per_day.items() if (building, date) not in existing]
+
+    if not rows:
+        return rows
+
+    # Rows written by a concurrent upload since the check above are skipped by the unique index
+    statement = upsert(ElectricityData, ['building', 'date'])
+    if db.session.get_bind().dialect.insert_executemany_returning:
+        # SQLite and PostgreSQL return only the rows the INSERT did not skip
+        result = db.session.execute(statement.returning(ElectricityData.building, ElectricityData.date), rows)
+        inserted = {(building, date) for building, date in result}
+    else:
+        # MySQL has no RETURNING. Its repeatable-read snapshot was taken by the check above,
+        # so a re-read sees this transaction's inserts but not rows another upload committed since
+        db.session.execute(statement, rows)
+        inserted = find_existing_pairs(readings.keys(), min(dates), max(dates)) - existing
+    return [row for row in rows if (row['building'], row['date']) in inserted]
@@ -1,22 +1,32 @@
-from flask import Flask, jsonify, request
+from flask import Flask, g, has_request_context, jsonify, request
 import numpy as np
 from flask_cors import CORS
-import pandas as pd
-import re
+import atexit
+import json
+import multiprocessing
+import os
+import tempfile
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
 import mysql.connector
-from flask_caching import Cache
+from cache_store import create_cache, ensure_private_directory, period_key_matcher
 from apscheduler.schedulers.background import BackgroundScheduler
 import threading
+from concurrent.futures import ThreadPoolExecutor, wait
 from Predictor import Predictor
 from urllib.parse import unquote
 from scipy import stats
 import numpy as np
 from collections import defaultdict
 from models import db, ElectricityData, ElectricityStatistics
-from AnomalyDetector import AnomalyDetector
-from anomaly_routes import anomaly_bp
+from ingest import ingest_files
+from upload_jobs import UploadJobQueue
+from monthly_stats import next_month_start
+from availability import availability_etag, load_availability_index, repair_availability_index
+from timeseries import RESOLUTIONS, aggregate_readings, lttb
+from response_format import compress_response, matching_etag, to_columnar, wants_columnar
+from anomaly_routes import anomaly_bp, anomaly_detector
+from anomaly_watermarks import data_fingerprint, detector_options, find_watermark, load_stored_alerts, record_watermark
 import smtplib
 from email.message import EmailMessage
 from flask_mail import Mail, Message
@@ -29,11 +39,40 @@ app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
 db.init_app(app)
 
-# Add cache
-app.config['CACHE_TYPE'] = 'SimpleCache'
-app.config['CACHE_THRESHOLD'] = 1000
+# Add cache ('memory' per process, 'filesystem' or 'redis' to share it between workers)
+app.config['CACHE_BACKEND'] = os.environ.get('CACHE_BACKEND', 'memory')
+app.config['CACHE_DIR'] = os.environ.get('CACHE_DIR') or os.path.join(app.instance_path, 'cache')  # Filesystem backend; must not be shared with other users
+app.config['CACHE_REDIS_URL'] = os.environ.get('CACHE_REDIS_URL', 'redis://localhost:6379/0')
+app.config['CACHE_MAX_BYTES'] = int(os.environ.get('CACHE_MAX_BYTES', 64 * 1024 * 1024))  # Budget by payload size, not entry count
 app.config['CACHE_DEFAULT_TIMEOUT'] = 3600  
-cache = Cache(app)
+app.config['CACHE_MAX_STALENESS'] = 3600  # Seconds an expired entry may still be served while it is refreshed
+app.config['CACHE_WARM_TOP_N'] = 50  # Most requested entries re-loaded by the scheduler
+app.config['CACHE_WARM_WORKERS'] = 4
+app.config['CACHE_WARM_TIME_BUDGET'] = 60  # Seconds
+app.config['CACHE_SNAPSHOT_PATH'] = os.environ.get('CACHE_SNAPSHOT_PATH') or os.path.join(app.instance_path, 'cache.snapshot')  # In a directory only this user can write
+app.config['CACHE_SNAPSHOT_INTERVAL'] = 5  # Minutes between snapshots of the memory cache
+cache = create_cache(app.config)
+
+# Uploaded files are streamed to disk here and parsed from their paths
+app.config['UPLOAD_SPOOL_DIR'] = os.environ.get('UPLOAD_SPOOL_DIR') or os.path.join(app.instance_path, 'uploads')
+
+# python main.py runs the development server with the reloader
+DEBUG = True
+
+def is_serving_process():
+    """
+    True in the process that serves requests.
+
+    Under the reloader, the parent process only watches files and restarts a child (which
+    has WERKZEUG_RUN_MAIN set), so the parent must not restore, save or schedule anything
+    or it would overwrite the child's snapshot. Parse-pool workers re-import this module
+    and are excluded too.
+    """
+    if multiprocessing.parent_process() is not None:
+        return False
+    if __name__ == '__main__' and DEBUG:
+        return os.environ.get('WERKZEUG_RUN_MAIN') == 'true'
+    return True
 
 # Configure Flask-Mail
 app.config['MAIL_SERVER'] = 'smtp.gmail.com'
@@ -47,6 +86,9 @@ mail = Mail(app)
 # Create scheduler
 scheduler = BackgroundScheduler()
 
+# Background queue for asynchronous uploads
+upload_jobs = UploadJobQueue()
+
 app.register_blueprint(anomaly_bp, url_prefix='/api/anomalies')
 
 # Create tables 
@@ -56,105 +98,60 @@ with app.app_context():
 # Define global variable for data
 monthly_data = {}
 
-# Function to check if data is already in the database
-def is_duplicate_data(year, month, day, building):
-    formatted_date = datetime(year, month, day).date()
-    return db.session.query(ElectricityData.id).filter_by(date=formatted_date, building=building).first() is not None
-def is_duplicate_stats(year, month, building):
-    formatted_date = datetime(year, month, 1).date()
-    return db.session.query(ElectricityStatistics.id).filter_by(date=formatted_date, building=building).first() is not None
+def spool_uploads(files):
+    """
+    Stream uploaded files to the private spool directory without reading them into memory.
 
+    Args:
+        files: Werkzeug FileStorage objects from the request
 
-def parse_csv(file):
+    Returns:
+        List of (filename, path) tuples
+    """
+    directory = ensure_private_directory(app.config['UPLOAD_SPOOL_DIR'])
+    uploads = []
     try:
-        # Read the CSV file
-        df = pd.read_csv(file)
-
-        building_info = df.loc[0, 'Group']
-        building_number = re.search(r'Building\s(\d+)', building_info).group(1)
-
-        # Extract the date columns (assumes the first two columns are not part of the date-based data)
-        date_columns = df.columns[2:]
-
-        # Extract the consumption data and ensure it's converted to a list of floats
-        consumption_data = df.iloc[0, 2:].astype(float)
-
-        # Check for empty consumption data
-        if not any(consumption_data):  # Check if the list has valid non-zero data
-            return None, "No valid consumption data found in the file."
-        
-        monthly_consumption_data = {}
-
-        # Input data into database
-        for date, consumption in zip(date_columns, consumption_data):
-            parsed_date = datetime.strptime(date, '%m/%d/%Y %H:%M')  # Parse the date and time
-            month_number = parsed_date.month
-            year_number = parsed_date.year
-            day_number = parsed_date.day
-
-            # Map numeric month to month name
-            months = {
-                1: 'January', 2: 'February', 3: 'March', 4: 'April',
-                5: 'May', 6: 'June', 7: 'July', 8: 'August',
-                9: 'September', 10: 'October', 11: 'November', 12: 'December'
-            }
-
-            month_name = months.get(month_number, 'Unknown')
-
-            # Check for duplicate data
-            if is_duplicate_data(year_number, int(month_number), int(day_number), f"Building {building_number}"):
-                continue  # Skip duplicate data
-
-            formatted_date = parsed_date.date()
-            new_entry = ElectricityData(
-                month=month_name,
-                date=formatted_date,
-                consumption=consumption,
-                building=f"Building {building_number}"
-            )
-            db.session.add(new_entry)
-
-            # Collect monthly consumption data
-            if month_name not in monthly_consumption_data:
-                monthly_consumption_data[month_name] = []
-            monthly_consumption_data[month_name].append(consumption)
-
-        db.session.commit()
-
-        for month_name, consumption_data in monthly_consumption_data.items():
-            mean_value = float(np.mean(consumption_data))
-            highest_value = float(np.max(consumption_data))
-            lowest_value = float(np.min(consumption_data))
-            median_value = float(np.median(consumption_data))
-
-            if is_duplicate_stats(year_number, list(months.keys())[list(months.values()).index(month_name)], f"Building {building_number}"):
-                continue  # Skip duplicate statistics data
-
-            # Insert statistics data into ElectricityStatistics table
-            stat_entry = ElectricityStatistics(
-                month=month_name,
-                date=datetime(year_number, list(months.keys())[list(months.values()).index(month_name)], 1).date(), 
-                mean=mean_value,
-                highest=highest_value,
-                lowest=lowest_value,
-                median=median_value,
-                building=f"Building {building_number}"
-            )
-            db.session.add(stat_entry)
-            db.session.commit()
-            
-            # Store the data for the month
-            monthly_data[month_name] = consumption_data
-
-        # Convert consumption data to a list to ensure it is serializable
-        serializable_data = {month: data for month, data in monthly_consumption_data.items()}
-
-        return month_name, serializable_data
+        for file in files:
+            handle, path = tempfile.mkstemp(suffix='.csv', dir=directory)
+            uploads.append((file.filename, path))
+            with os.fdopen(handle, 'wb') as spooled:
+                file.save(spooled)
+    except Exception:
+        remove_spooled_uploads(uploads)
+        raise
+    return uploads
+
+def remove_spooled_uploads(uploads):
+    """Delete the spooled files of (filename, path) uploads"""
+    for _, path in uploads:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
 
-    except Exception as e:
-        db.session.rollback()
-        return None, f"Error processing file: {str(e)}"
-    
+def ingest_uploads(uploads, progress=None):
+    """Ingest spooled (filename, path) uploads, invalidate the cache entries they made stale and delete the files"""
+    # Parse files in parallel and write them through a single batched writer
+    try:
+        results, timing = ingest_files(uploads, progress)
+    finally:
+        remove_spooled_uploads(uploads)
+    for result in results:
+        if 'data' in result:
+            monthly_data.update(result['data'])
+
+    # Evict only the cache entries that depend on the months that just got new rows
+    touched = {tuple(month) for result in results for month in result.get('months', [])}
+    invalidate_cached_periods(touched)
+    return results, timing
+
+def run_upload_job(uploads, progress):
+    """Background worker entry point for asynchronous uploads"""
+    with app.app_context():
+        try:
+            return ingest_uploads(uploads, progress)
+        finally:
+            db.session.remove()
 
 @app.route('/upload', methods=['POST'])
 def upload_files():
@@ -164,23 +161,46 @@ def upload_files():
         if not files:
             return jsonify({'error': 'No files uploaded'}), 400
 
-        results = []
-        for file in files:
-            print(f"Processing file: {file.filename}")  # Debug statement
-            month, data = parse_csv(file)
-            if not month:
-                return jsonify({'error': data}), 400
-            results.append({'month': month, 'data': data})
+        uploads = spool_uploads(files)
+        print(f"Processing {len(uploads)} file(s)")  # Debug statement
 
-        refresh_cache()
-        return jsonify({
-            'message': 'Files uploaded successfully',
-            'results': results
-        })
+        # Optionally hand the upload to the background worker and return a job id right away
+        run_async = request.args.get('async', request.form.get('async', '')).lower() in ('1', 'true', 'yes')
+        if run_async:
+            job_id = upload_jobs.submit(
+                [filename for filename, _ in uploads],
+                lambda progress: run_upload_job(uploads, progress)
+            )
+            return jsonify({
+                'message': 'Upload queued',
+                'job_id': job_id,
+                'status_url': f"/upload/status/{job_id}"
+            }), 202
+
+        results, timing = ingest_uploads(uploads)
+
+        errors = [result for result in results if 'error' in result]
+        response = {
+            'message': 'Files uploaded successfully' if not errors else f"{len(errors)} of {len(results)} files failed",
+            'results': results,
+            'timing': timing
+        }
+        if errors:
+            response['error'] = f"{errors[0]['filename']}: {errors[0]['error']}"
+            return jsonify(response), 400
+        return jsonify(response)
 
     except Exception as e:
+        db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
+@app.route('/upload/status/<job_id>', methods=['GET'])
+def upload_status(job_id):
+    job = upload_jobs.status(job_id)
+    if job is None:
+        return jsonify({'error': 'Upload job not found'}), 404
+    return jsonify(job)
+
 def generate_cache_key(year, month, day, building, data_type="data"):
     """Generate a consistent cache key for given parameters"""
     building_clean = building.replace(" ", "_")
@@ -188,6 +208,14 @@ def generate_cache_key(year, month, day, building, data_type="data"):
         return f"electricity_{data_type}_{year}_{month}_all_{building_clean}"
     return f"electricity_{data_type}_{year}_{month}_{day}_{building_clean}"
 
+def invalidate_cached_periods(periods):
+    """Evict the cache entries derived from the given (building, year, month) periods"""
+    if not periods:
+        return []
+    evicted = cache.delete_where(period_key_matcher(periods))
+    print(f"Evicted {len(evicted)} cache entries for {len(periods)} updated period(s)")
+    return evicted
+
 def cache_data(key, data):
     """Cache data with the given key, ensuring we don't exceed cache limits"""
     print(f"Setting cache for key: {key}")
@@ -201,117 +229,179 @@ def get_cached_data(key):
 def get_from_db_or_cache(year, month, day, building, data_type="data"):
     """Helper function to implement cache-first pattern"""
     cache_key = generate_cache_key(year, month, day, building, data_type)
-    # Try to get from cache first
-    cached_data = get_cached_data(cache_key)
-    if cached_data is not None:
-        return cached_data
-    
-    
-    # If not in cache, fetch from database
+    params = (year, month, day, building, data_type)
+    cache.record_access(cache_key, params)
+    # Try to get from cache first; concurrent misses on the same key share one database fetch,
+    # and an expired entry is served while one background refresh replaces it
+    result, age, status = cache.get_or_load_with_age(
+        cache_key,
+        lambda: load_from_db(*params),
+        background_loader=lambda: load_from_db_in_context(params)
+    )
+    if has_request_context():
+        g.cache_age = age
+        g.cache_status = status
+    return result
+
+def get_many_from_db_or_cache(year, month, day, buildings, data_type="data"):
+    """
+    Cache-first lookup for several buildings under the single-item cache keys.
+
+    Buildings missing from the cache are loaded together with one query and cached
+    individually, so later single-item requests hit them too. Misses share in-flight
+    loads with concurrent requests and stale entries are refreshed in the background,
+    as in get_from_db_or_cache.
+
+    Returns:
+        Dictionary of building -> result (None when the building has no data)
+    """
+    params = {}
+    for building in buildings:
+        cache_key = generate_cache_key(year, month, day, building, data_type)
+        params[cache_key] = (year, month, day, building, data_type)
+        cache.record_access(cache_key, params[cache_key])
+
+    def load_missing(keys):
+        loaded = load_many_from_db(year, month, day, [params[key][3] for key in keys], data_type)
+        return {key: loaded.get(params[key][3]) for key in keys}
+
+    results = cache.get_or_load_many(
+        list(params),
+        load_missing,
+        background_loader=lambda key: load_from_db_in_context(params[key])
+    )
+    return {params[key][3]: value for key, (value, _, _) in results.items()}
+
+# First element of the warming params recorded for /fetch-range keys
+RANGE_PARAMS = 'range'
+
+def load_from_db_in_context(params):
+    """Run load_from_db (or load_range_from_db for range params) in its own app context, for threads outside the request"""
+    with app.app_context():
+        try:
+            if params[0] == RANGE_PARAMS:
+                return load_range_from_db(*params[1:])
+            return load_from_db(*params)
+        finally:
+            db.session.remove()
+
+def load_from_db(year, month, day, building, data_type="data"):
+    """Fetch the data or statistics behind a cache key from the database"""
+    return load_many_from_db(year, month, day, [building], data_type).get(building)
+
+def load_many_from_db(year, month, day, buildings, data_type="data"):
+    """
+    Fetch the data or statistics behind the cache keys of several buildings with one IN (...) query.
+
+    Args:
+        year, month, day: Period as in the /fetch-data and /stats routes (day 0 is the whole month for
+            data and the whole year for stats)
+        buildings: List of building names
+        data_type: "data" or "stats"
+
+    Returns:
+        Dictionary of building -> result; buildings without data are left out
+    """
+    results = {}
     if data_type == "data":
         if day == 0:  # Monthly data
             start_date = datetime(year, month, 1).date()
-            if month == 12:
-                end_date = datetime(year + 1, 1, 1).date()
-            else:
-                end_date = datetime(year, month + 1, 1).date()
-            
             db_data = ElectricityData.query.filter(
                 ElectricityData.date >= start_date,
-                ElectricityData.date < end_date,
-                ElectricityData.building == building
-            ).all()
-            
-            if not db_data:
-                return None
-                
-            result = [{
-                'month': entry.month,
-                'date': entry.date.isoformat(),
-                'consumption': entry.consumption,
-                'building': entry.building
-            } for entry in db_data]
-            
+                ElectricityData.date < next_month_start(start_date),
+                ElectricityData.building.in_(buildings)
+            ).order_by(ElectricityData.building, ElectricityData.date).all()
+
+            for entry in db_data:
+                results.setdefault(entry.building, []).append({
+                    'month': entry.month,
+                    'date': entry.date.isoformat(),
+                    'consumption': entry.consumption,
+                    'building': entry.building
+                })
+
         else:  # Daily data
             date = datetime(year, month, day).date()
-            db_data = ElectricityData.query.filter_by(
-                date=date,
-                building=building
-            ).first()
-            
-            if not db_data:
-                return None
-                
-            result = {
-                'month': db_data.month,
-                'date': db_data.date.isoformat(),
-                'consumption': db_data.consumption,
-                'building': db_data.building
-            }
+            db_data = ElectricityData.query.filter(
+                ElectricityData.date == date,
+                ElectricityData.building.in_(buildings)
+            ).all()
+
+            for entry in db_data:
+                results.setdefault(entry.building, {
+                    'month': entry.month,
+                    'date': entry.date.isoformat(),
+                    'consumption': entry.consumption,
+                    'building': entry.building
+                })
             
     elif data_type == "stats":
         if day == 0:  # Yearly stats request
-            # Get all monthly stats for the requested year and building
+            # Get all monthly stats for the requested year and buildings
+            # Half-open date range so the (building, date) index can be used
             db_data = ElectricityStatistics.query.filter(
-                db.func.extract('year', ElectricityStatistics.date) == year,
-                ElectricityStatistics.building == building
-            ).order_by(ElectricityStatistics.date).all()
+                ElectricityStatistics.building.in_(buildings),
+                ElectricityStatistics.date >= datetime(year, 1, 1).date(),
+                ElectricityStatistics.date < datetime(year + 1, 1, 1).date()
+            ).order_by(ElectricityStatistics.building, ElectricityStatistics.date).all()
+
+            by_building = {}
+            for stat in db_data:
+                by_building.setdefault(stat.building, []).append(stat)
+            for building, building_stats in by_building.items():
+                results[building] = yearly_stats(building_stats)
             
-            if not db_data:
-                return None
-                
-            # Prepare monthly data using stored statistics
-            monthly_data = []
+        else:  # Monthly stats
+            start_date = datetime(year, month, 1).date()
+            db_data = ElectricityStatistics.query.filter(
+                ElectricityStatistics.building.in_(buildings),
+                ElectricityStatistics.date >= start_date,
+                ElectricityStatistics.date < next_month_start(start_date)
+            ).all()
+
             for stat in db_data:
-                monthly_data.append({
+                results.setdefault(stat.building, {
                     'month': stat.month,
-                    'consumption': stat.mean,  
+                    'date': stat.date.isoformat(),
                     'mean': stat.mean,
                     'highest': stat.highest,
                     'lowest': stat.lowest,
-                    'median': stat.median
+                    'median': stat.median,
+                    'building': stat.building
                 })
-            
-            # Find overall extremes across the year
-            highest_month = max(db_data, key=lambda x: x.highest)
-            lowest_month = min(db_data, key=lambda x: x.lowest)
-            
-            result = {
-                'mean': float(np.mean([stat.mean for stat in db_data])),
-                'highest': highest_month.highest,
-                'lowest': lowest_month.lowest,
-                'highestMonth': highest_month.month,
-                'lowestMonth': lowest_month.month,
-                'monthlyData': monthly_data  # Includes all stored stats for each month
-            }
-            
-        else:  # Monthly stats
-            db_data = ElectricityStatistics.query.filter(
-                db.func.extract('year', ElectricityStatistics.date) == year,
-                db.func.extract('month', ElectricityStatistics.date) == month,
-                ElectricityStatistics.building == building
-            ).first()
-            
-            if not db_data:
-                return None
-                
-            result = {
-                'month': db_data.month,
-                'date': db_data.date.isoformat(),
-                'mean': db_data.mean,
-                'highest': db_data.highest,
-                'lowest': db_data.lowest,
-                'median': db_data.median,
-                'building': db_data.building
-            }
     
-    if result is not None:
-        cache_data(cache_key, result)
-    return result
+    return results
+
+def yearly_stats(db_data):
+    """Summarise one building's monthly ElectricityStatistics rows (in date order) into the yearly stats payload"""
+    # Prepare monthly data using stored statistics
+    monthly_data = []
+    for stat in db_data:
+        monthly_data.append({
+            'month': stat.month,
+            'consumption': stat.mean,  
+            'mean': stat.mean,
+            'highest': stat.highest,
+            'lowest': stat.lowest,
+            'median': stat.median
+        })
+    
+    # Find overall extremes across the year
+    highest_month = max(db_data, key=lambda x: x.highest)
+    lowest_month = min(db_data, key=lambda x: x.lowest)
+    
+    return {
+        'mean': float(np.mean([stat.mean for stat in db_data])),
+        'highest': highest_month.highest,
+        'lowest': lowest_month.lowest,
+        'highestMonth': highest_month.month,
+        'lowestMonth': lowest_month.month,
+        'monthlyData': monthly_data  # Includes all stored stats for each month
+    }
 
 def print_july_2024_cache():
     print("\n=== July 2024 Cache Contents ===")
-    cache_keys = list(cache.cache._cache.keys())
+    cache_keys = cache.keys()
     for key in cache_keys:
         if '2024_7' in key or 'July' in key or 'Building_555' in key:
             value = cache.get(key)
@@ -319,6 +409,19 @@ def print_july_2024_cache():
             print("Value:", value)
     
 
+@app.after_request
+def add_cache_headers(response):
+    """Tell clients how old a cached /stats, /fetch-data or /fetch-range payload is"""
+    if 'cache_status' in g:
+        response.headers['X-Cache'] = g.cache_status.upper()
+        response.headers['X-Cache-Age'] = str(int(g.cache_age or 0))
+    return response
+
+@app.after_request
+def compress_json(response):
+    """Send JSON with brotli or gzip when the client accepts it"""
+    return compress_response(response, request.accept_encodings)
+
 @app.route('/stats/<int:year>/<int:month>/<int:day>/<building>', methods=['GET'])
 def get_stats_by_params(year, month, day, building):
     building = unquote(building)
@@ -337,56 +440,222 @@ def fetch_data_by_params(year, month, day, building):
         data = get_from_db_or_cache(year, month, day, building, "data")
         if data is None:
             return jsonify({'error': 'No data found for the specified parameters'}), 404
+        if isinstance(data, list) and wants_columnar(request):
+            return jsonify(to_columnar(data))
         return jsonify(data)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/fetch-batch/<int:year>/<int:month>/<int:day>', methods=['GET', 'POST'])
+def fetch_batch_by_params(year, month, day):
+    """
+    Readings and statistics for many buildings in one response (e.g. every building on the heatmap).
+
+    Buildings come from a JSON body {"buildings": [...]} or repeated ?building= parameters.
+    Each building's entries match what /fetch-data and /stats return for the same
+    parameters, or null when it has no data. ?format=columnar sends monthly readings
+    as parallel arrays.
+    """
+    body = request.get_json(silent=True)
+    if body is None:
+        body = {}
+    if not isinstance(body, dict):
+        return jsonify({'error': 'JSON body must be an object like {"buildings": [...]}'}), 400
+    # JSON strings arrive as sent and query values are already decoded by Flask
+    buildings = body.get('buildings') or request.args.getlist('building')
+    if not buildings:
+        return jsonify({'error': 'No buildings specified'}), 400
+    if not isinstance(buildings, list) or not all(isinstance(building, str) for building in buildings):
+        return jsonify({'error': 'buildings must be a list of names'}), 400
+    buildings = list(dict.fromkeys(buildings))
+
+    try:
+        data = get_many_from_db_or_cache(year, month, day, buildings, "data")
+        if wants_columnar(request):
+            data = {building: to_columnar(rows) if isinstance(rows, list) else rows for building, rows in data.items()}
+        return jsonify({
+            'data': data,
+            'stats': get_many_from_db_or_cache(year, month, day, buildings, "stats")
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/fetch-range/<building>', methods=['GET'])
+def fetch_range(building):
+    """
+    Readings for an arbitrary date range at day, week or month resolution.
+
+    Query parameters: start and end (YYYY-MM-DD, inclusive), resolution (day, week or
+    month; default day), max_points, an optional budget of at least 3 points the
+    series is downsampled to with LTTB, and format=columnar to send the points as parallel arrays.
+    """
+    building = unquote(building)
+    try:
+        start_date = datetime.strptime(request.args['start'], '%Y-%m-%d').date()
+        end_date = datetime.strptime(request.args['end'], '%Y-%m-%d').date()
+        resolution = request.args.get('resolution', 'day')
+        max_points = request.args.get('max_points', type=int)
+    except (KeyError, ValueError):
+        return jsonify({'error': 'start and end must be given as YYYY-MM-DD'}), 400
+    if resolution not in RESOLUTIONS:
+        return jsonify({'error': f"resolution must be one of {', '.join(RESOLUTIONS)}"}), 400
+    if end_date < start_date:
+        return jsonify({'error': 'end must not be before start'}), 400
+    if max_points is not None and max_points < 3:
+        return jsonify({'error': 'max_points must be at least 3'}), 400
+
+    try:
+        cache_key = f"electricity_range_{start_date}_{end_date}_{resolution}_{max_points or 0}_{building.replace(' ', '_')}"
+        params = (RANGE_PARAMS, building, start_date, end_date, resolution, max_points)
+        cache.record_access(cache_key, params)
+        # Same single-flight and stale-while-revalidate path as /fetch-data and /stats
+        data, g.cache_age, g.cache_status = cache.get_or_load_with_age(
+            cache_key,
+            lambda: load_range_from_db(*params[1:]),
+            background_loader=lambda: load_from_db_in_context(params)
+        )
+        if data is None:
+            return jsonify({'error': 'No data found for the specified parameters'}), 404
+        if wants_columnar(request):
+            data = {**data, 'points': to_columnar(data['points'])}
+        return jsonify(data)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def load_range_from_db(building, start_date, end_date, resolution='day', max_points=None):
+    """Fetch a building's readings between two dates and aggregate them to the requested resolution"""
+    rows = db.session.query(ElectricityData.date, ElectricityData.consumption).filter(
+        ElectricityData.building == building,
+        ElectricityData.date >= start_date,
+        ElectricityData.date <= end_date
+    ).order_by(ElectricityData.date).all()
+    if not rows:
+        return None
+
+    dates, values = zip(*rows)
+    aggregated = aggregate_readings(dates, values, resolution)
+    if max_points and len(aggregated) > max_points:
+        # Keep the points that preserve the shape of the series
+        timestamps = aggregated.index.asi8
+        aggregated = aggregated.iloc[lttb(timestamps, aggregated['mean'].to_numpy(), max_points)]
+
+    points = [{
+        'date': bucket.date().isoformat(),
+        'consumption': float(row.mean),
+        'highest': float(row.highest),
+        'lowest': float(row.lowest),
+        'total': float(row.total),
+        'days': int(row.days)
+    } for bucket, row in zip(aggregated.index, aggregated.itertuples(index=False))]
+
+    return {
+        'building': building,
+        'start': start_date.isoformat(),
+        'end': end_date.isoformat(),
+        'resolution': resolution,
+        'points': points
+    }
+
 # Other routes remain unchanged (upload, stats, predict, get-available-data)
 
 # Cache maintenance
+def warm_cache_key(cache_key, params):
+    """Reload one cache entry from the database in its own app context"""
+    result = load_from_db_in_context(params)
+    if result is not None:
+        cache.set(cache_key, result)
+
 def refresh_cache():
-    """Periodically refresh popular cache items with proper app context"""
+    """Periodically re-load the most requested cache entries within a time budget"""
     with app.app_context():
         try:
-            # Get most frequently accessed data and refresh those
-            popular_buildings = db.session.query(
-                ElectricityData.building,
-                db.func.count(ElectricityData.building)
-            ).group_by(ElectricityData.building).order_by(db.func.count(ElectricityData.building).desc()).limit(5).all()
-            
-            for building, _ in popular_buildings:
-                # Refresh last 3 months of data for popular buildings
-                current_date = datetime.now()
-                for i in range(3):
-                    month = current_date.month - i
-                    year = current_date.year
-                    if month < 1:
-                        month += 12
-                        year -= 1
-                    get_from_db_or_cache(year, month, 0, building, "data")
-                    get_from_db_or_cache(year, month, 0, building, "stats")
-                    
-            print(f"Cache refreshed at {datetime.now()}")
+            popular = cache.most_accessed(app.config['CACHE_WARM_TOP_N'])
+
+            if not popular:
+                # No requests seen yet: warm the latest month with data for the most recently updated buildings
+                latest = db.session.query(
+                    ElectricityData.building,
+                    db.func.max(ElectricityData.date)
+                ).group_by(ElectricityData.building).order_by(
+                    db.func.max(ElectricityData.date).desc()
+                ).limit(app.config['CACHE_WARM_TOP_N'] // 2).all()
+                for building, last_date in latest:
+                    for data_type in ("data", "stats"):
+                        params = (last_date.year, last_date.month, 0, building, data_type)
+                        popular.append((generate_cache_key(*params), params))
         except Exception as e:
             print(f"Error refreshing cache: {e}")
+            return
         finally:
             # Ensure session is closed
             db.session.remove()
 
+    # Warm concurrently and give up on whatever is left when the budget runs out
+    pool = ThreadPoolExecutor(max_workers=app.config['CACHE_WARM_WORKERS'], thread_name_prefix='cache-warm')
+    futures = [pool.submit(warm_cache_key, cache_key, params) for cache_key, params in popular]
+    done, not_done = wait(futures, timeout=app.config['CACHE_WARM_TIME_BUDGET'])
+    for future in not_done:
+        future.cancel()
+    pool.shutdown(wait=False)
+
+    errors = [future.exception() for future in done if future.exception() is not None]
+    for error in errors[:3]:
+        print(f"Error refreshing cache: {error}")
+    print(f"Cache refreshed at {datetime.now()}: {len(done) - len(errors)} of {len(futures)} entries warmed")
+
+
+def save_cache_snapshot():
+    """Write the in-memory cache to CACHE_SNAPSHOT_PATH so the next start begins warm"""
+    try:
+        saved = cache.save_snapshot(app.config['CACHE_SNAPSHOT_PATH'])
+        print(f"Cache snapshot saved at {datetime.now()}: {saved} entries")
+    except Exception as e:
+        print(f"Error saving cache snapshot: {e}")
+
+def restore_cache_snapshot():
+    """Start warm from the last snapshot written by a previous run"""
+    try:
+        print(f"Restored {cache.load_snapshot(app.config['CACHE_SNAPSHOT_PATH'])} cache entries from snapshot")
+    except Exception as e:
+        print(f"Error restoring cache snapshot: {e}")
+
+if is_serving_process():
+    restore_cache_snapshot()
+    atexit.register(save_cache_snapshot)
 
 def scheduler_job():
     """Wrapper function to run refresh_cache with app context"""
     with app.app_context():
         refresh_cache()
 
+def availability_repair_job():
+    """Rebuild availability bitmaps that drifted from ElectricityData"""
+    with app.app_context():
+        try:
+            drifted = repair_availability_index()
+            if drifted:
+                print(f"Availability index rebuilt at {datetime.now()} for {len(drifted)} building(s)")
+        except Exception as e:
+            db.session.rollback()
+            print(f"Error repairing availability index: {e}")
+        finally:
+            db.session.remove()
+
 def start_scheduler():
     """Start the scheduler with proper app context handling"""
     scheduler.add_job(scheduler_job, 'interval', minutes=30)
+    scheduler.add_job(availability_repair_job, 'interval', hours=6)
+    scheduler.add_job(save_cache_snapshot, 'interval', minutes=app.config['CACHE_SNAPSHOT_INTERVAL'])
     scheduler.start()
 
+@app.route('/cache-stats', methods=['GET'])
+def get_cache_stats():
+    """Hit/miss/eviction counters per key family for this worker"""
+    return jsonify(cache.stats())
+
 def print_cache_keys():
     try:
-        cache_keys = list(cache.cache._cache.keys())  # Retrieve all cache keys
+        cache_keys = cache.keys()  # Retrieve all cache keys
         print("Current Cache Keys:")
         for key in cache_keys:
             print(key)
@@ -426,6 +695,9 @@ def analyze_building_anomalies():
         threshold = float(data.get('threshold', 3.0))
         store_results = data.get('store_results', True)
         include_stats = data.get('include_stats', True)
+        window = int(data.get('window', 30))  # Previous readings compared against for rolling_z_score
+        reuse_model = bool(data.get('reuse_model', False))  # Score with fitted building_LOF models
+        force = bool(data.get('force', False))  # Re-run even if the data has not changed since the last run
         
         # Decode building name if it's URL encoded
         building = unquote(building)
@@ -441,61 +713,77 @@ def analyze_building_anomalies():
             else:
                 end_date = datetime(year, month + 1, 1).date()
         
-        # Query data from database
-        db_data = ElectricityData.query.filter(
-            ElectricityData.date >= start_date,
-            ElectricityData.date < end_date,
-            ElectricityData.building == building
-        ).order_by(ElectricityData.date).all()
-        
-        if not db_data:
+        # Skip detection when this analysis already ran over the same data and its results are stored
+        fingerprint = data_fingerprint(building, start_date, end_date)
+        if not fingerprint[0]:
             return jsonify({'error': 'No data found for the specified parameters'}), 404
+        options = detector_options(method, window=window, reuse_model=reuse_model)
+        watermark = None
+        if store_results and not force:
+            watermark = find_watermark(building, start_date, end_date, method, threshold, options, fingerprint)
+            if watermark is not None and include_stats and watermark.statistics is None:
+                watermark = None  # Statistics were not kept with that run
+
+        if watermark is not None:
+            anomalies = load_stored_alerts(watermark)
+            new_anomalies_count = 0
+            stats = json.loads(watermark.statistics) if include_stats else {}
+        else:
+            # Query data from database
+            db_data = ElectricityData.query.filter(
+                ElectricityData.date >= start_date,
+                ElectricityData.date < end_date,
+                ElectricityData.building == building
+            ).order_by(ElectricityData.date).all()
         
-        # Format data for anomaly detection
-        formatted_data = [{
-            'date': entry.date,
-            'consumption': entry.consumption,
-            'building': entry.building
-        } for entry in db_data]
+            # Format data for anomaly detection
+            formatted_data = [{
+                'date': entry.date,
+                'consumption': entry.consumption,
+                'building': entry.building
+            } for entry in db_data]
         
-        # Use the AnomalyDetector class for detection
-        detector = AnomalyDetector()
-        anomalies = detector.detect_anomalies(formatted_data, method, threshold)
+            # Use the shared AnomalyDetector so fitted building_LOF models are kept between requests
+            detector = anomaly_detector
+            anomalies = detector.detect_anomalies(formatted_data, method, threshold, window=window, reuse_model=reuse_model)
         
-        # Store anomalies in database if requested
-        new_anomalies_count = 0
-        if store_results:
-            new_anomalies_count = detector.store_anomalies(anomalies)
+            # Store anomalies in database if requested
+            new_anomalies_count = 0
+            if store_results:
+                new_anomalies_count = detector.store_anomalies(anomalies)
         
-        # Calculate additional statistics if requested
-        stats = {}
-        if include_stats:
-            # Calculate daily statistics
-            daily_consumption = {}
-            for entry in formatted_data:
-                date_str = entry['date'].strftime('%Y-%m-%d')
-                if date_str not in daily_consumption:
-                    daily_consumption[date_str] = []
-                daily_consumption[date_str].append(entry['consumption'])
+            # Calculate additional statistics if requested
+            stats = {}
+            if include_stats:
+                # Calculate daily statistics
+                daily_consumption = {}
+                for entry in formatted_data:
+                    date_str = entry['date'].strftime('%Y-%m-%d')
+                    if date_str not in daily_consumption:
+                        daily_consumption[date_str] = []
+                    daily_consumption[date_str].append(entry['consumption'])
             
-            # Calculate mean consumption for each day
-            daily_means = {date: np.mean(values) for date, values in daily_consumption.items()}
+                # Calculate mean consumption for each day
+                daily_means = {date: np.mean(values) for date, values in daily_consumption.items()}
             
-            # Find days with highest and lowest mean consumption
-            if daily_means:
-                highest_day = max(daily_means.items(), key=lambda x: x[1])
-                lowest_day = min(daily_means.items(), key=lambda x: x[1])
+                # Find days with highest and lowest mean consumption
+                if daily_means:
+                    highest_day = max(daily_means.items(), key=lambda x: x[1])
+                    lowest_day = min(daily_means.items(), key=lambda x: x[1])
                 
-                stats = {
-                    'total_days': len(daily_means),
-                    'days_with_anomalies': len(set(a['date'].strftime('%Y-%m-%d') for a in anomalies)),
-                    'highest_consumption_day': highest_day[0],
-                    'highest_consumption_value': highest_day[1],
-                    'lowest_consumption_day': lowest_day[0],
-                    'lowest_consumption_value': lowest_day[1],
-                    'building_overall_consumption': sum(entry['consumption'] for entry in formatted_data),
-                    'anomaly_percentage': (len(anomalies) / len(formatted_data)) * 100 if formatted_data else 0
-                }
+                    stats = {
+                        'total_days': len(daily_means),
+                        'days_with_anomalies': len(set(a['date'].strftime('%Y-%m-%d') for a in anomalies)),
+                        'highest_consumption_day': highest_day[0],
+                        'highest_consumption_value': highest_day[1],
+                        'lowest_consumption_day': lowest_day[0],
+                        'lowest_consumption_value': lowest_day[1],
+                        'building_overall_consumption': sum(entry['consumption'] for entry in formatted_data),
+                        'anomaly_percentage': (len(anomalies) / len(formatted_data)) * 100 if formatted_data else 0
+                    }
+
+            if store_results:
+                record_watermark(building, start_date, end_date, method, threshold, options, fingerprint, anomalies, stats if include_stats else None)
         
         # Return results with formatted dates for display
         for anomaly in anomalies:
@@ -509,7 +797,8 @@ def analyze_building_anomalies():
             'error': sum(1 for a in anomalies if a['severity'] == 'Error'),
             'warning': sum(1 for a in anomalies if a['severity'] == 'Warning'),
             'method': method,
-            'threshold': threshold
+            'threshold': threshold,
+            'from_stored_results': watermark is not None
         }
         
         if include_stats:
@@ -523,85 +812,24 @@ def analyze_building_anomalies():
 
 @app.route('/get-available-data', methods=['GET'])
 def get_available_data():
-    """Endpoint to list all available data in the system (from cache and database)"""
+    """Endpoint to list all available data in the system, served from the availability index"""
     try:
-        with app.app_context():
-            # First try to get from cache if available
-            cache_key = "available_data_summary"
-            cached_data = get_cached_data(cache_key)
-            if cached_data:
-                return jsonify(cached_data)
-
-            # If not in cache, build the data structure from database
-            available_data = {}
-
-            # Get all unique buildings
-            buildings = db.session.query(
-                ElectricityData.building.distinct()
-            ).all()
-
-            for (building,) in buildings:
-                building_clean = building.replace(" ", "_")
-                available_data[building] = {}
-
-                # Get all years with data for this building
-                years = db.session.query(
-                    db.func.extract('year', ElectricityData.date).distinct()
-                ).filter(
-                    ElectricityData.building == building
-                ).order_by(
-                    db.func.extract('year', ElectricityData.date).desc()
-                ).all()
-
-                for (year,) in years:
-                    year = int(year)
-                    available_data[building][year] = {}
-
-                    # Get all months with data for this building/year
-                    months = db.session.query(
-                        db.func.extract('month', ElectricityData.date).distinct()
-                    ).filter(
-                        db.func.extract('year', ElectricityData.date) == year,
-                        ElectricityData.building == building
-                    ).order_by(
-                        db.func.extract('month', ElectricityData.date)
-                    ).all()
-
-                    for (month,) in months:
-                        month = int(month)
-                        available_data[building][year][month] = []
-
-                        # Check if we have full month data cached
-                        month_cache_key = generate_cache_key(year, month, 0, building)
-                        if get_cached_data(month_cache_key):
-                            available_data[building][year][month].append('all')
-
-                        # Get individual days with data
-                        days = db.session.query(
-                            db.func.extract('day', ElectricityData.date).distinct()
-                        ).filter(
-                            db.func.extract('year', ElectricityData.date) == year,
-                            db.func.extract('month', ElectricityData.date) == month,
-                            ElectricityData.building == building
-                        ).order_by(
-                            db.func.extract('day', ElectricityData.date)
-                        ).all()
-
-                        for (day,) in days:
-                            day = int(day)
-                            # Check if this specific day is cached
-                            day_cache_key = generate_cache_key(year, month, day, building)
-                            if get_cached_data(day_cache_key):
-                                available_data[building][year][month].append(day)
-
-                        # If no specific days but we have month data, add 'all'
-                        if not available_data[building][year][month] and days:
-                            available_data[building][year][month].append('all')
-
-            # Cache this summary for 1 hour
-            cache_data(cache_key, available_data)
-
-            return jsonify(available_data)
+        include_days = request.args.get('detail') == 'days'
+        etag = availability_etag()
+        if include_days:
+            etag += '-days'
+
+        # Let clients skip the download when nothing changed since their last request,
+        # checked before any bitmap is loaded
+        matched = matching_etag(request.if_none_match, etag)
+        if matched:
+            response = app.response_class(status=304)
+            response.set_etag(matched)
+        else:
+            response = jsonify(load_availability_index(include_days))
+            response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -669,14 +897,16 @@ def send_specific_alert():
 
 if __name__ == '__main__':    
 # Run scheduler in a separate thread with app context
-    with app.app_context():
-        # Initial cache refresh
-        refresh_cache()
-        # Start scheduler
-        scheduler_thread = threading.Thread(target=start_scheduler)
-        scheduler_thread.daemon = True  # Daemonize thread so it exits with main
-        scheduler_thread.start()
+    if is_serving_process():
+        with app.app_context():
+            # Initial cache refresh in the background; requests are served from the snapshot meanwhile
+            refresh_thread = threading.Thread(target=refresh_cache, daemon=True)
+            refresh_thread.start()
+            # Start scheduler
+            scheduler_thread = threading.Thread(target=start_scheduler)
+            scheduler_thread.daemon = True  # Daemonize thread so it exits with main
+            scheduler_thread.start()
     
-    app.run(debug=True)
+    app.run(debug=DEBUG)
 
 
@@ -0,0 +1,49 @@
+"""
+Add the (building, date) unique keys to tables created before they were declared.
+
+db.create_all() only creates missing tables, so existing databases need this once.
+Duplicate rows are removed first, keeping the oldest row of each (building, date).
+
+Usage (from the backend directory):
+    python migrations/add_building_date_unique_keys.py
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import Index, inspect, text
+from main import app
+from models import db, ElectricityData, ElectricityStatistics
+
+UNIQUE_KEYS = [
+    (ElectricityData, 'uix_electricity_data_building_date'),
+    (ElectricityStatistics, 'uix_electricity_statistics_building_date'),
+]
+
+
+def add_unique_key(model, name):
+    table = model.__tablename__
+    inspector = inspect(db.engine)
+    existing = {index['name'] for index in inspector.get_indexes(table)}
+    existing |= {constraint['name'] for constraint in inspector.get_unique_constraints(table)}
+    if name in existing:
+        print(f"{table}: {name} already exists")
+        return
+
+    # The derived table keeps MySQL from rejecting a subquery on the table being deleted from
+    result = db.session.execute(text(
+        f"DELETE FROM {table} WHERE id NOT IN ("
+        f"SELECT keep_id FROM (SELECT MIN(id) AS keep_id FROM {table} GROUP BY building, date) AS keep)"
+    ))
+    db.session.commit()
+    print(f"{table}: removed {result.rowcount} duplicate rows")
+
+    Index(name, model.__table__.c.building, model.__table__.c.date, unique=True).create(db.engine)
+    print(f"{table}: created {name}")
+
+
+if __name__ == '__main__':
+    with app.app_context():
+        for model, name in UNIQUE_KEYS:
+            add_unique_key(model, name)
@@ -10,6 +10,11 @@ class ElectricityData(db.Model):
     consumption = db.Column(db.Float, nullable=False)
     building = db.Column(db.String(50), nullable=False)
 
+    # One reading per building per day; the unique index also serves the (building, date range) lookups
+    __table_args__ = (
+        db.UniqueConstraint('building', 'date', name='uix_electricity_data_building_date'),
+    )
+
     def __init__(self, month, date, consumption, building):
         self.month = month
         self.date = date
@@ -25,6 +30,11 @@ class ElectricityStatistics(db.Model):
     lowest = db.Column(db.Float, nullable=False)
     median = db.Column(db.Float, nullable=False)
     building = db.Column(db.String(50), nullable=False)
+
+    # One statistics row per building per month
+    __table_args__ = (
+        db.UniqueConstraint('building', 'date', name='uix_electricity_statistics_building_date'),
+    )
     
     def __init__(self, month, date, mean, highest, lowest, median, building):
         self.month = month
@@ -62,4 +72,93 @@ class AnomalyAlert(db.Model):
         self.detection_method = detection_method
         self.is_acknowledged = False
         self.is_sdt = False
-        self.is_cleared = False
\ No newline at end of file
+        self.is_cleared = False
+
+class DataAvailability(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    building = db.Column(db.String(50), nullable=False)
+    year = db.Column(db.Integer, nullable=False)
+    days = db.Column(db.LargeBinary(46), nullable=False)  # Bit n is set when day-of-year n + 1 has a reading
+    version = db.Column(db.Integer, nullable=False, default=1)  # Bumped on every write, for the ETag
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        db.UniqueConstraint('building', 'year', name='uix_availability_building_year'),
+    )
+
+    def __init__(self, building, year, days):
+        self.building = building
+        self.year = year
+        self.days = days
+
+
+# Running consumption statistics per building, updated by the online detector as readings arrive
+class AnomalyState(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    building = db.Column(db.String(50), nullable=False)
+    count = db.Column(db.Integer, nullable=False)
+    mean = db.Column(db.Float, nullable=False)
+    m2 = db.Column(db.Float, nullable=False)  # Sum of squared deviations from the mean (Welford)
+    ewma = db.Column(db.Float, nullable=False)
+    ewm_var = db.Column(db.Float, nullable=False)
+    last_date = db.Column(db.Date)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        db.UniqueConstraint('building', name='uix_anomaly_state_building'),
+    )
+
+    def __init__(self, building, count, mean, m2, ewma, ewm_var, last_date=None):
+        self.building = building
+        self.count = count
+        self.mean = mean
+        self.m2 = m2
+        self.ewma = ewma
+        self.ewm_var = ewm_var
+        self.last_date = last_date
+
+
+# Marks an anomaly analysis whose results are stored, with a fingerprint of the data it saw
+class AnomalyWatermark(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    building = db.Column(db.String(50), nullable=False)  # '' when every building was analyzed together
+    period_start = db.Column(db.Date, nullable=False)
+    period_end = db.Column(db.Date, nullable=False)  # Exclusive
+    detection_method = db.Column(db.String(30), nullable=False)
+    threshold = db.Column(db.Float, nullable=False)
+    options = db.Column(db.String(200), nullable=False, default='')  # Normalized JSON of the detector options that change the output
+    row_count = db.Column(db.Integer, nullable=False)
+    max_data_id = db.Column(db.Integer, nullable=False)
+    statistics = db.Column(db.Text)  # JSON of the run's summary statistics, if any
+    analyzed_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        db.UniqueConstraint('building', 'period_start', 'period_end', 'detection_method', 'threshold', 'options',
+                            name='uix_anomaly_watermark_scope'),
+    )
+
+    def __init__(self, building, period_start, period_end, detection_method, threshold, options, row_count, max_data_id, statistics=None):
+        self.building = building
+        self.period_start = period_start
+        self.period_end = period_end
+        self.detection_method = detection_method
+        self.threshold = threshold
+        self.options = options
+        self.row_count = row_count
+        self.max_data_id = max_data_id
+        self.statistics = statistics
+
+
+# An alert a stored anomaly run flagged, so the run's results can be read back exactly
+class AnomalyWatermarkAlert(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    watermark_id = db.Column(db.Integer, db.ForeignKey('anomaly_watermark.id'), nullable=False)
+    alert_id = db.Column(db.Integer, db.ForeignKey('anomaly_alert.id'), nullable=False)
+
+    __table_args__ = (
+        db.UniqueConstraint('watermark_id', 'alert_id', name='uix_anomaly_watermark_alert'),
+    )
+
+    def __init__(self, watermark_id, alert_id):
+        self.watermark_id = watermark_id
+        self.alert_id = alert_id
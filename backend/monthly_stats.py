@@ -0,0 +1,82 @@
+from collections import defaultdict
+import pandas as pd
+from sqlalchemy import and_, or_
+from bulk_sql import upsert
+from models import db, ElectricityData, ElectricityStatistics
+
+# Map numeric month to month name
+MONTH_NAMES = {
+    1: 'January', 2: 'February', 3: 'March', 4: 'April',
+    5: 'May', 6: 'June', 7: 'July', 8: 'August',
+    9: 'September', 10: 'October', 11: 'November', 12: 'December'
+}
+
+
+def next_month_start(month_start):
+    """Return the first day of the month after month_start"""
+    if month_start.month == 12:
+        return month_start.replace(year=month_start.year + 1, month=1)
+    return month_start.replace(month=month_start.month + 1)
+
+
+def refresh_monthly_statistics(keys):
+    """
+    Recompute ElectricityStatistics for the (building, month) keys touched by an ingest.
+
+    The readings of every touched month are fetched with one query, aggregated with a
+    single pandas groupby, and written with one upsert on the (building, date) unique
+    key, so a month that arrives over several files ends up with statistics over all
+    of its days.
+
+    Args:
+        keys: Iterable of (building, first-of-month date) tuples
+
+    Returns:
+        Number of statistics rows inserted or updated
+    """
+    keys = set(keys)
+    if not keys:
+        return 0
+
+    # One date range per building covering its touched months
+    ranges = defaultdict(list)
+    for building, month_start in keys:
+        ranges[building].append(month_start)
+    conditions = [
+        and_(
+            ElectricityData.building == building,
+            ElectricityData.date >= min(month_starts),
+            ElectricityData.date < next_month_start(max(month_starts))
+        ) for building, month_starts in ranges.items()
+    ]
+
+    readings = pd.DataFrame(
+        db.session.query(ElectricityData.building, ElectricityData.date, ElectricityData.consumption)
+        .filter(or_(*conditions)).all(),
+        columns=['building', 'date', 'consumption']
+    )
+    if readings.empty:
+        return 0
+
+    readings['month_start'] = pd.to_datetime(readings['date']).dt.to_period('M').dt.start_time.dt.date
+    aggregated = readings.groupby(['building', 'month_start'])['consumption'].agg(
+        mean='mean', highest='max', lowest='min', median='median'
+    )
+    aggregated = aggregated[aggregated.index.isin(keys)]
+
+    rows = [{
+        'month': MONTH_NAMES[month_start.month],
+        'date': month_start,
+        'building': building,
+        'mean': float(values['mean']),
+        'highest': float(values['highest']),
+        'lowest': float(values['lowest']),
+        'median': float(values['median'])
+    } for (building, month_start), values in aggregated.iterrows()]
+
+    if rows:
+        db.session.execute(
+            upsert(ElectricityStatistics, ['building', 'date'], ['mean', 'highest', 'lowest', 'median']),
+            rows
+        )
+    return len(aggregated)
@@ -0,0 +1,139 @@
+import math
+from datetime import datetime
+from bulk_sql import upsert
+from models import db, AnomalyAlert, AnomalyState, ElectricityData
+
+# Weight of the newest reading in the exponentially weighted mean and variance
+EWMA_ALPHA = 0.1
+
+# Readings a building needs before new ones are scored
+MIN_HISTORY = 14
+
+# |z| above which a reading is flagged; Critical above ONLINE_THRESHOLD + 1
+ONLINE_THRESHOLD = 3.0
+
+DETECTION_METHOD = 'online_ewma'
+
+# Rows fetched at a time when seeding a building's state from its history
+SEED_BATCH_SIZE = 50000
+
+STATE_FIELDS = ('count', 'mean', 'm2', 'ewma', 'ewm_var', 'last_date')
+
+
+def _empty_state():
+    return {'count': 0, 'mean': 0.0, 'm2': 0.0, 'ewma': 0.0, 'ewm_var': 0.0, 'last_date': None}
+
+
+def _score(state, value):
+    """z of value against the building's EWMA baseline, or None while it is still warming up"""
+    if state['count'] < MIN_HISTORY or state['ewm_var'] <= 0:
+        return None
+    return (value - state['ewma']) / math.sqrt(state['ewm_var'])
+
+
+def _update(state, value, day):
+    """Fold one reading into the running statistics in place"""
+    # Welford's update of the all-time mean and sum of squared deviations
+    state['count'] += 1
+    delta = value - state['mean']
+    state['mean'] += delta / state['count']
+    state['m2'] += delta * (value - state['mean'])
+
+    if state['count'] <= MIN_HISTORY:
+        # Warming up: the EWMA baseline starts from the plain mean and variance
+        state['ewma'] = state['mean']
+        state['ewm_var'] = state['m2'] / state['count']
+    else:
+        diff = value - state['ewma']
+        increment = EWMA_ALPHA * diff
+        state['ewma'] += increment
+        state['ewm_var'] = (1 - EWMA_ALPHA) * (state['ewm_var'] + diff * increment)
+
+    if state['last_date'] is None or day > state['last_date']:
+        state['last_date'] = day
+
+
+def _seed_states(buildings, exclude):
+    """
+    Build the state of buildings the detector has not seen yet from their stored history.
+
+    Runs once per building, streaming its readings in date order.
+
+    Args:
+        buildings: Building names without a state row
+        exclude: (building, date) pairs that are about to be scored and must not be folded in yet
+    """
+    states = {building: _empty_state() for building in buildings}
+    history = db.session.query(
+        ElectricityData.building, ElectricityData.date, ElectricityData.consumption
+    ).filter(
+        ElectricityData.building.in_(list(buildings))
+    ).order_by(ElectricityData.building, ElectricityData.date).yield_per(SEED_BATCH_SIZE)
+
+    for building, day, consumption in history:
+        if (building, day) not in exclude:
+            _update(states[building], consumption, day)
+    return states
+
+
+def score_new_readings(rows):
+    """
+    Score newly written readings against each building's running statistics (caller commits).
+
+    Each reading is compared with its building's EWMA mean and variance before being
+    folded into them, so the cost is O(new rows) rather than a rescan of the history.
+    Flagged readings are upserted as AnomalyAlert rows and the updated statistics are
+    written back to AnomalyState with one upsert. Back-filled readings, dated on or
+    before the building's latest scored reading, are neither scored nor folded in: the
+    EWMA depends on order, and they are left to the batch detectors.
+
+    Args:
+        rows: Row dictionaries with 'building', 'date' and 'consumption' keys, as returned
+            by bulk_insert_readings
+
+    Returns:
+        List of anomaly dictionaries that were stored
+    """
+    by_building = {}
+    for row in rows:
+        by_building.setdefault(row['building'], []).append(row)
+    if not by_building:
+        return []
+
+    # Lock the touched states so concurrent uploads for the same building apply in turn
+    states = {
+        state.building: {field: getattr(state, field) for field in STATE_FIELDS}
+        for state in AnomalyState.query.filter(AnomalyState.building.in_(list(by_building))).with_for_update()
+    }
+    unseen = [building for building in by_building if building not in states]
+    if unseen:
+        states.update(_seed_states(unseen, {(row['building'], row['date']) for row in rows}))
+
+    anomalies = []
+    for building, building_rows in by_building.items():
+        state = states[building]
+        for row in sorted(building_rows, key=lambda row: row['date']):
+            if state['last_date'] is not None and row['date'] <= state['last_date']:
+                continue
+            z_score = _score(state, row['consumption'])
+            if z_score is not None and abs(z_score) > ONLINE_THRESHOLD:
+                anomalies.append({
+                    'date': row['date'],
+                    'building': building,
+                    'consumption': float(row['consumption']),
+                    'z_score': float(z_score),
+                    'severity': "Critical" if abs(z_score) > ONLINE_THRESHOLD + 1 else "Warning",
+                    'detection_method': DETECTION_METHOD
+                })
+            _update(state, row['consumption'], row['date'])
+
+    db.session.execute(
+        upsert(AnomalyState, ['building'], list(STATE_FIELDS) + ['updated_at']),
+        [{'building': building, **states[building], 'updated_at': datetime.utcnow()} for building in by_building]
+    )
+    if anomalies:
+        db.session.execute(
+            upsert(AnomalyAlert, ['date', 'building', 'detection_method'], ['consumption', 'z_score', 'severity']),
+            anomalies
+        )
+    return anomalies
@@ -0,0 +1,102 @@
+import gzip
+
+try:
+    import brotli  # Optional dependency; responses fall back to gzip without it
+except ImportError:
+    brotli = None
+
+# Responses smaller than this are sent uncompressed
+MIN_COMPRESS_BYTES = 1024
+
+GZIP_LEVEL = 5
+BROTLI_QUALITY = 5
+
+
+def wants_columnar(request):
+    """True when the client opted into the columnar format with ?format=columnar"""
+    return request.args.get('format') == 'columnar'
+
+
+# Keys a monthly series repeats on every row; only these are sent once at the top level
+CONSTANT_KEYS = ('building', 'month')
+
+
+def to_columnar(rows, constant_keys=CONSTANT_KEYS):
+    """
+    Turn a list of row dictionaries into parallel arrays.
+
+    Keys listed in constant_keys whose value is the same on every row (such as 'building'
+    or 'month' in a monthly series) are sent once at the top level instead of being
+    repeated. Every other key is always an array, even when its values happen to agree,
+    so clients can rely on the shape.
+
+    Args:
+        rows: List of dictionaries with the same keys
+        constant_keys: Keys that may be lifted out of the columns
+
+    Returns:
+        Dictionary with 'format', 'length', the lifted keys and a 'columns' dictionary
+        of key -> list of values
+    """
+    result = {'format': 'columnar', 'length': len(rows), 'columns': {}}
+    if not rows:
+        return result
+
+    for key in rows[0]:
+        values = [row[key] for row in rows]
+        if key in constant_keys and all(value == values[0] for value in values):
+            result[key] = values[0]
+        else:
+            result['columns'][key] = values
+    return result
+
+
+def matching_etag(if_none_match, etag):
+    """
+    Return the tag in If-None-Match that names etag in any content encoding, or None.
+
+    compress_response gives each encoding its own ETag, so a client revalidates with
+    the suffixed tag it was sent.
+    """
+    for tag in (etag, f"{etag}-br", f"{etag}-gzip"):
+        if tag in if_none_match:
+            return tag
+    return None
+
+
+def compress_response(response, accept_encodings):
+    """
+    Compress a JSON response body with brotli or gzip, whichever the client accepts.
+
+    Args:
+        response: Flask response
+        accept_encodings: The request's parsed Accept-Encoding header
+
+    Returns:
+        The same response, compressed in place when it is worth it
+    """
+    if (response.status_code != 200 or response.direct_passthrough
+            or 'Content-Encoding' in response.headers or response.mimetype != 'application/json'):
+        return response
+
+    body = response.get_data()
+    if len(body) < MIN_COMPRESS_BYTES:
+        return response
+
+    # The body now depends on the request's Accept-Encoding either way
+    response.vary.add('Accept-Encoding')
+    if brotli is not None and accept_encodings['br']:
+        response.set_data(brotli.compress(body, quality=BROTLI_QUALITY))
+        response.headers['Content-Encoding'] = 'br'
+    elif accept_encodings['gzip']:
+        response.set_data(gzip.compress(body, compresslevel=GZIP_LEVEL))
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        return response
+
+    # The compressed bytes are a different representation, so they get their own ETag
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag(f"{etag}-{response.headers['Content-Encoding']}", weak)
+    response.headers['Content-Length'] = str(len(response.get_data()))
+    return response
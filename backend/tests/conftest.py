@@ -0,0 +1,24 @@
+import os
+import sys
+
+import pytest
+from flask import Flask
+
+# The backend modules import each other as top-level modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import db  # noqa: E402
+
+
+@pytest.fixture
+def app():
+    """Flask app bound to an empty in-memory SQLite database, inside an app context"""
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
@@ -0,0 +1,189 @@
+from datetime import date, timedelta
+
+import numpy as np
+import pytest
+
+from AnomalyDetector import AnomalyDetector
+from models import db, AnomalyAlert
+
+
+def readings(values, building='Building 110', start=date(2024, 1, 1)):
+    return [{'date': start + timedelta(days=day), 'consumption': value, 'building': building}
+            for day, value in enumerate(values)]
+
+
+@pytest.fixture
+def detector():
+    return AnomalyDetector()
+
+
+def test_mad_flags_outliers_when_most_readings_are_equal(detector):
+    anomalies = detector.detect_anomalies(readings([1, 1, 1, 1, 50]), method='mad', threshold=3.0)
+
+    assert [anomaly['consumption'] for anomaly in anomalies] == [50.0]
+
+
+def test_mad_does_not_flag_a_flat_series(detector):
+    assert detector.detect_anomalies(readings([7, 7, 7, 7]), method='mad', threshold=3.0) == []
+
+
+def test_mad_scores_each_building_separately(detector):
+    data = readings([100, 101, 99, 100, 102, 98, 100, 160]) + readings([5, 6, 5, 4, 5, 6, 5, 4], 'Building 111')
+
+    anomalies = detector.detect_anomalies(data, method='mad', threshold=3.0)
+
+    assert [(anomaly['building'], anomaly['consumption']) for anomaly in anomalies] == [('Building 110', 160.0)]
+
+
+def naive_rolling_z_scores(data, window):
+    """Reference rolling z-scores: each reading against its building's previous window readings"""
+    z_scores = {}
+    for building in {item['building'] for item in data}:
+        rows = sorted((item for item in data if item['building'] == building), key=lambda item: item['date'])
+        for index, item in enumerate(rows):
+            previous = [row['consumption'] for row in rows[max(0, index - window):index]]
+            if len(previous) < max(3, window // 2) or np.std(previous) == 0:
+                continue
+            z_scores[(building, item['date'])] = (item['consumption'] - np.mean(previous)) / np.std(previous)
+    return z_scores
+
+
+@pytest.mark.parametrize('window', [3, 6, 30])
+def test_rolling_z_score_matches_a_naive_window(detector, window):
+    rng = np.random.default_rng(window)
+    data = readings(list(rng.normal(100, 10, 80))) + readings(list(rng.normal(5000, 300, 50)), 'Building 111')
+    data = [data[index] for index in rng.permutation(len(data))]
+
+    anomalies = detector.detect_anomalies(data, method='rolling_z_score', threshold=1.5, window=window)
+
+    expected = {key: z for key, z in naive_rolling_z_scores(data, window).items() if abs(z) > 1.5}
+    assert {(anomaly['building'], anomaly['date']): anomaly['z_score'] for anomaly in anomalies} == pytest.approx(expected)
+
+
+def test_rolling_z_score_follows_a_level_shift(detector):
+    data = readings([100 + day % 3 for day in range(20)] + [200 + day % 3 for day in range(20)])
+
+    anomalies = detector.detect_anomalies(data, method='rolling_z_score', threshold=3.0, window=6)
+
+    # The shift is flagged once; the readings after it are judged against the new level
+    assert [anomaly['date'] for anomaly in anomalies] == [date(2024, 1, 21)]
+
+
+def test_rolling_z_score_needs_half_a_window_of_history(detector):
+    data = readings([100, 101, 99, 100, 900])
+
+    assert detector.detect_anomalies(data, method='rolling_z_score', window=10) == []
+    assert [anomaly['consumption'] for anomaly in detector.detect_anomalies(data, method='rolling_z_score', window=8)] == [900.0]
+
+
+def test_grouped_z_score_uses_each_buildings_own_baseline(detector):
+    data = readings([100, 102, 98, 101, 99, 100, 103, 97, 100, 130]) + readings([5000] * 9 + [9000], 'Building 111')
+
+    grouped = detector.detect_anomalies(data, method='grouped_z_score', threshold=2.5)
+    pooled = detector.detect_anomalies(data, method='z_score', threshold=2.5)
+
+    assert sorted((anomaly['building'], anomaly['consumption']) for anomaly in grouped) == [
+        ('Building 110', 130.0), ('Building 111', 9000.0)
+    ]
+    assert ('Building 110', 130.0) not in {(anomaly['building'], anomaly['consumption']) for anomaly in pooled}
+    assert all(anomaly['expected_low'] < 100 < anomaly['expected_high'] for anomaly in grouped if anomaly['building'] == 'Building 110')
+
+
+def test_grouped_z_score_by_weekday(detector):
+    # Weekdays near 100 and weekends near 20; one Saturday at a weekday level
+    values = []
+    for day in range(56):
+        weekend = (date(2024, 1, 1) + timedelta(days=day)).weekday() >= 5
+        values.append((20 if weekend else 100) + day % 2)
+    values[54] = 100  # 2024-02-24, a Saturday
+    data = readings(values)
+
+    by_weekday = detector.detect_anomalies(data, method='grouped_z_score', threshold=2.0, by_weekday=True)
+    overall = detector.detect_anomalies(data, method='grouped_z_score', threshold=2.0)
+
+    assert [anomaly['date'] for anomaly in by_weekday] == [date(2024, 2, 24)]
+    assert overall == []
+
+
+def test_reused_lof_model_keeps_training_labels_and_scores_only_new_days(detector, monkeypatch):
+    history = readings([100 + (day % 7) for day in range(60)] + [400])
+    fitted = detector.detect_anomalies(history, 'building_LOF', n_neighbors=20)
+    model = detector._lof_models[('Building 110', 20, 0.1)]['model']
+    scored = []
+    score_samples = model.score_samples
+    monkeypatch.setattr(model, 'score_samples', lambda values: scored.append(len(values)) or score_samples(values))
+
+    later = readings([103, 500], start=date(2024, 3, 2))
+    reused = detector.detect_anomalies(history + later, 'building_LOF', n_neighbors=20, reuse_model=True)
+
+    assert scored == [2]
+    assert {anomaly['date'] for anomaly in fitted} <= {anomaly['date'] for anomaly in reused}
+    assert date(2024, 3, 3) in {anomaly['date'] for anomaly in reused}
+
+
+def test_reused_lof_model_scores_readings_outside_its_training_dates(detector):
+    detector.detect_anomalies(readings([100 + (day % 7) for day in range(366)]), 'building_LOF', n_neighbors=20)
+    january_2023 = readings([100 + (day % 5) for day in range(30)] + [5000], start=date(2023, 1, 1))
+
+    fresh = AnomalyDetector().detect_anomalies(january_2023, 'building_LOF', n_neighbors=20)
+    reused = detector.detect_anomalies(january_2023, 'building_LOF', n_neighbors=20, reuse_model=True)
+
+    assert date(2023, 1, 31) in {anomaly['date'] for anomaly in fresh}
+    assert date(2023, 1, 31) in {anomaly['date'] for anomaly in reused}
+
+
+def test_lof_models_are_limited(detector, monkeypatch):
+    monkeypatch.setattr('AnomalyDetector.LOF_MODEL_CACHE_SIZE', 2)
+    data = [reading for building in range(4) for reading in readings([1, 2, 3, 4, 50], f'Building {building}')]
+
+    detector.detect_anomalies(data, 'building_LOF', n_neighbors=3)
+
+    assert list(detector._lof_models) == [('Building 2', 3, 0.1), ('Building 3', 3, 0.1)]
+
+
+def alert(day, building='Building 110', method='z_score', consumption=500.0, scores=None):
+    return {'date': day, 'building': building, 'detection_method': method, 'consumption': consumption,
+            'severity': 'Warning', 'detection_time': None, **({'z_score': 4.0} if scores is None else scores)}
+
+
+def test_store_anomalies_counts_only_new_keys(app, detector):
+    assert detector.store_anomalies([alert(date(2024, 1, 1)), alert(date(2024, 1, 2))]) == 2
+
+    stored = detector.store_anomalies([
+        alert(date(2024, 1, 1)),  # Existing
+        alert(date(2024, 1, 3)),  # New
+        alert(date(2024, 1, 3), consumption=600.0),  # Repeated in the batch
+        alert(date(2024, 1, 1), 'Building 111'),  # New for another building
+        alert(date(2024, 1, 2), method='mad'),  # New for another method
+    ])
+
+    assert stored == 3
+    assert AnomalyAlert.query.count() == 5
+    # The last occurrence of a repeated key wins
+    assert AnomalyAlert.query.filter_by(date=date(2024, 1, 3)).one().consumption == 600.0
+
+
+def test_store_anomalies_updates_keep_user_flags(app, detector):
+    detector.store_anomalies([alert(date(2024, 1, 1))])
+    stored = AnomalyAlert.query.one()
+    stored.is_acknowledged = True
+    stored.is_sdt = True
+    db.session.commit()
+
+    assert detector.store_anomalies([alert(date(2024, 1, 1), consumption=700.0, scores={'z_score': 5.5})]) == 0
+
+    updated = AnomalyAlert.query.one()
+    assert (updated.consumption, updated.z_score) == (700.0, 5.5)
+    assert updated.is_acknowledged and updated.is_sdt and not updated.is_cleared
+
+
+def test_store_anomalies_z_score_column(app, detector):
+    detector.store_anomalies([
+        alert(date(2024, 1, 1), scores={'z_score': -3.5}),
+        alert(date(2024, 1, 1), method='building_LOF', scores={'lof_score': 1.8}),
+        alert(date(2024, 1, 1), method='other', scores={}),
+    ])
+
+    scores = {row.detection_method: row.z_score for row in AnomalyAlert.query}
+    # LOF methods keep their LOF score in z_score; alerts with neither score store 0
+    assert scores == {'z_score': -3.5, 'building_LOF': 1.8, 'other': 0}
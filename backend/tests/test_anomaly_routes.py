@@ -0,0 +1,128 @@
+from datetime import date
+
+import pytest
+
+from anomaly_routes import anomaly_bp
+from models import db, AnomalyAlert, AnomalyWatermark, ElectricityData
+
+
+@pytest.fixture
+def client(app):
+    app.register_blueprint(anomaly_bp, url_prefix='/api/anomalies')
+    return app.test_client()
+
+
+def add_days(values, first_day=1):
+    for offset, value in enumerate(values):
+        day = date(2024, 1, first_day + offset)
+        db.session.add(ElectricityData(month='January', date=day, consumption=value, building='Building 110'))
+    db.session.commit()
+
+
+def analyze(client, **params):
+    body = {'building': 'Building 110', 'year': 2024, 'month': 1, 'method': 'z_score', 'threshold': 2.0, **params}
+    response = client.post('/api/anomalies/analyze-anomalies', json=body)
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()
+
+
+def flagged_days(result):
+    return [anomaly['date'] for anomaly in result['anomalies']]
+
+
+def test_stored_read_after_new_data_returns_only_the_latest_run(client):
+    first = [100 + day % 3 for day in range(10)]
+    first[4] = 300  # 2024-01-05 stands out in the first ten days
+    add_days(first)
+    assert flagged_days(analyze(client)) == ['2024-01-05']
+
+    # The rest of the month makes 2024-01-05 ordinary and adds a new outlier
+    rest = [50 if day % 2 else 350 for day in range(21)]
+    rest[9] = 2500
+    add_days(rest, first_day=11)
+    rerun = analyze(client)
+    assert not rerun['from_stored_results']
+    assert flagged_days(rerun) == ['2024-01-20']
+
+    stored = analyze(client)
+    assert stored['from_stored_results']
+    assert flagged_days(stored) == ['2024-01-20']
+    # The alert the first run raised is kept for the alert page
+    assert [alert.date for alert in AnomalyAlert.query.order_by(AnomalyAlert.date)] == [date(2024, 1, 5), date(2024, 1, 20)]
+
+
+def test_rerun_keeps_flags_on_alerts_it_flags_again(client):
+    values = [100 + day % 3 for day in range(10)]
+    values[4] = 300
+    add_days(values)
+    analyze(client)
+    AnomalyAlert.query.one().is_acknowledged = True
+    db.session.commit()
+
+    add_days([101, 100, 102], first_day=11)
+    assert flagged_days(analyze(client)) == ['2024-01-05']
+    assert AnomalyAlert.query.one().is_acknowledged
+
+
+def test_runs_at_other_thresholds_keep_their_own_results(client):
+    values = [100 + day % 3 for day in range(10)]
+    values[4] = 300
+    add_days(values)
+    assert flagged_days(analyze(client, threshold=2.0)) == ['2024-01-05']
+
+    assert flagged_days(analyze(client, threshold=5.0, force=True)) == []
+
+    lower = analyze(client, threshold=2.0)
+    assert lower['from_stored_results']
+    assert flagged_days(lower) == ['2024-01-05']
+    assert analyze(client, threshold=5.0)['anomalies'] == []
+
+
+def test_switching_between_month_and_year_scopes_keeps_user_flags(client):
+    january = [100 + day % 3 for day in range(31)]
+    january[4] = 300
+    add_days(january)
+    # A later month with much larger readings makes 2024-01-05 ordinary for the year
+    for day in range(1, 29):
+        db.session.add(ElectricityData(month='February', date=date(2024, 2, day), consumption=300 + day % 2 * 600,
+                                       building='Building 110'))
+    db.session.commit()
+
+    assert flagged_days(analyze(client)) == ['2024-01-05']
+    AnomalyAlert.query.one().is_acknowledged = True
+    db.session.commit()
+
+    assert '2024-01-05' not in flagged_days(analyze(client, month=0))
+    assert flagged_days(analyze(client)) == ['2024-01-05']
+    assert AnomalyAlert.query.filter_by(date=date(2024, 1, 5)).one().is_acknowledged
+
+
+def test_other_detector_options_are_not_served_from_stored_results(client):
+    values = [100 + (day % 7) * 3 for day in range(31)]
+    values[25] = 200
+    add_days(values)
+
+    wide = analyze(client, method='rolling_z_score', window=20)
+    narrow = analyze(client, method='rolling_z_score', window=6)
+    forced = analyze(client, method='rolling_z_score', window=6, force=True)
+
+    assert not narrow['from_stored_results']
+    assert flagged_days(narrow) == flagged_days(forced) != flagged_days(wide)
+    assert analyze(client, method='rolling_z_score', window=6)['from_stored_results']
+    # The window 6 run overwrote the alerts the window 20 run was read back from
+    assert not analyze(client, method='rolling_z_score', window=20)['from_stored_results']
+
+
+def test_all_building_population_runs_are_not_recorded(client):
+    values = [100 + day % 3 for day in range(10)]
+    values[4] = 300
+    add_days(values)
+    analyze(client)
+    assert AnomalyWatermark.query.count() == 1
+
+    result = analyze(client, building=None)
+
+    assert flagged_days(result) == ['2024-01-05']
+    # The building's watermark is dropped because the run rewrote its alerts, and none replaces it
+    assert AnomalyWatermark.query.count() == 0
+    assert not analyze(client, building=None)['from_stored_results']
@@ -0,0 +1,51 @@
+from datetime import date
+
+from availability import availability_etag, load_availability_index, mark_days_available, repair_availability_index
+from models import db, ElectricityData
+
+
+def add_readings(building, days):
+    db.session.add_all(ElectricityData(month=day.strftime('%B'), date=day, consumption=1.0, building=building) for day in days)
+
+
+def test_etag_changes_only_when_the_index_does(app):
+    add_readings('Building 110', [date(2024, 1, 1)])
+    mark_days_available([('Building 110', date(2024, 1, 1))])
+    db.session.commit()
+    etag = availability_etag()
+
+    assert availability_etag() == etag
+
+    add_readings('Building 110', [date(2024, 1, 2)])
+    mark_days_available([('Building 110', date(2024, 1, 2))])
+    db.session.commit()
+    assert availability_etag() != etag
+
+
+def test_index_is_built_on_first_use(app):
+    add_readings('Building 110', [date(2024, 1, 1), date(2024, 3, 5)])
+    db.session.commit()
+
+    availability_etag()
+
+    assert load_availability_index(include_days=True) == {'Building 110': {2024: {1: [1], 3: [5]}}}
+
+
+def test_repair_rebuilds_only_drifted_buildings(app):
+    add_readings('Building 110', [date(2024, 1, 1)])
+    add_readings('Building 111', [date(2024, 1, 1)])
+    mark_days_available([('Building 110', date(2024, 1, 1)), ('Building 111', date(2024, 1, 1))])
+    db.session.commit()
+    assert repair_availability_index() == set()
+
+    # Written outside the upload path, so the index never heard of it
+    add_readings('Building 111', [date(2024, 2, 29)])
+    db.session.commit()
+    etag = availability_etag()
+
+    assert repair_availability_index() == {'Building 111'}
+    assert load_availability_index(include_days=True) == {
+        'Building 110': {2024: {1: [1]}},
+        'Building 111': {2024: {1: [1], 2: [29]}},
+    }
+    assert availability_etag() != etag
@@ -0,0 +1,257 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from cache_store import CacheBackend, ConsumptionCache, FileSystemBackend, MemoryBackend, create_cache, period_key_matcher
+
+
+def test_backends_must_implement_the_interface():
+    class Incomplete(CacheBackend):
+        def get(self, key):
+            return None
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+def test_filesystem_backend_creates_a_private_directory(tmp_path):
+    directory = tmp_path / 'cache'
+    cache = ConsumptionCache(FileSystemBackend(str(directory)))
+    cache.set('electricity_data_2024_1_0_Building 110', [1.0, 2.0])
+
+    assert os.stat(directory).st_mode & 0o777 == 0o700
+    assert cache.get('electricity_data_2024_1_0_Building 110') == [1.0, 2.0]
+
+
+@pytest.mark.skipif(not hasattr(os, 'getuid'), reason='POSIX permissions')
+@pytest.mark.parametrize('mode', [0o770, 0o777, 0o1777])
+def test_filesystem_backend_refuses_shared_directories(tmp_path, mode):
+    directory = tmp_path / 'shared'
+    directory.mkdir()
+    directory.chmod(mode)
+
+    with pytest.raises(PermissionError):
+        FileSystemBackend(str(directory))
+
+
+def test_filesystem_backend_scans_only_when_due(tmp_path, monkeypatch):
+    backend = FileSystemBackend(str(tmp_path / 'cache'), max_bytes=10 ** 6)
+    scans = []
+    real_scandir = os.scandir
+    monkeypatch.setattr(os, 'scandir', lambda path: scans.append(path) or real_scandir(path))
+
+    for index in range(250):
+        backend.set(f'key_{index}', (0, 0, index))
+
+    # The first write and then every PRUNE_INTERVAL writes
+    assert len(scans) == 3
+
+
+def test_filesystem_backend_prunes_once_over_budget(tmp_path):
+    backend = FileSystemBackend(str(tmp_path / 'cache'), max_bytes=2000)
+    evicted = []
+    backend.on_evict = evicted.append
+
+    for index in range(20):
+        backend.set(f'key_{index}', (0, 0, b'x' * 200))
+
+    sizes = [entry.stat().st_size for entry in os.scandir(tmp_path / 'cache')]
+    assert sum(sizes) <= 2000
+    assert evicted and 'key_19' in backend.keys()
+
+
+def test_filesystem_cache_needs_a_directory():
+    with pytest.raises(ValueError):
+        create_cache({'CACHE_BACKEND': 'filesystem', 'CACHE_DIR': None})
+
+    assert isinstance(create_cache({}).backend, MemoryBackend)
+
+
+def test_concurrent_misses_share_one_load():
+    cache = ConsumptionCache(MemoryBackend())
+    calls = []
+    start = threading.Barrier(16)
+    release = threading.Event()
+
+    def loader():
+        calls.append(1)
+        release.wait(5)
+        return {'mean': 1.0}
+
+    def request():
+        start.wait()
+        return cache.get_or_load('electricity_stats_2024_1_0_Building 110', loader)
+
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        futures = [pool.submit(request) for _ in range(16)]
+        # Let every thread reach the cache before the load finishes
+        time.sleep(0.2)
+        release.set()
+        results = [future.result() for future in futures]
+
+    assert len(calls) == 1
+    assert results == [{'mean': 1.0}] * 16
+    assert cache.stats()['stats']['coalesced'] == 15
+
+
+def test_late_miss_does_not_reload_a_published_value():
+    cache = ConsumptionCache(MemoryBackend())
+    key = 'electricity_data_2024_1_0_Building 110'
+    first_lookup = threading.Event()
+    leader_done = threading.Event()
+    lookup = cache._lookup
+    calls = []
+
+    def slow_first_lookup(lookup_key):
+        result = lookup(lookup_key)
+        if not first_lookup.is_set():
+            # This caller misses, then stalls until another caller has loaded and stored the key
+            first_lookup.set()
+            leader_done.wait(5)
+        return result
+
+    def loader():
+        calls.append(1)
+        return [1.0, 2.0]
+
+    cache._lookup = slow_first_lookup
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        late = pool.submit(cache.get_or_load, key, loader)
+        first_lookup.wait(5)
+        assert pool.submit(cache.get_or_load, key, loader).result() == [1.0, 2.0]
+        leader_done.set()
+        assert late.result() == [1.0, 2.0]
+
+    assert len(calls) == 1
+
+
+def test_loader_errors_reach_every_waiter():
+    cache = ConsumptionCache(MemoryBackend())
+    release = threading.Event()
+
+    def loader():
+        release.wait(5)
+        raise RuntimeError('database unavailable')
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        futures = [pool.submit(cache.get_or_load, 'electricity_data_2024_1_0_Building 110', loader) for _ in range(4)]
+        time.sleep(0.2)
+        release.set()
+        for future in futures:
+            with pytest.raises(RuntimeError):
+                future.result()
+
+
+def test_snapshot_round_trip_in_a_private_directory(tmp_path):
+    path = tmp_path / 'instance' / 'cache.snapshot'
+    cache = ConsumptionCache(MemoryBackend())
+    cache.set('electricity_data_2024_1_0_Building 110', [1.0, 2.0])
+
+    assert cache.save_snapshot(str(path)) == 1
+    assert os.stat(path.parent).st_mode & 0o777 == 0o700
+
+    restored = ConsumptionCache(MemoryBackend())
+    assert restored.load_snapshot(str(path)) == 1
+    assert restored.get('electricity_data_2024_1_0_Building 110') == [1.0, 2.0]
+
+
+@pytest.mark.skipif(not hasattr(os, 'getuid'), reason='POSIX permissions')
+def test_snapshot_others_can_write_is_not_loaded(tmp_path):
+    path = tmp_path / 'instance' / 'cache.snapshot'
+    cache = ConsumptionCache(MemoryBackend())
+    cache.set('electricity_data_2024_1_0_Building 110', [1.0])
+    cache.save_snapshot(str(path))
+    path.chmod(0o666)
+
+    with pytest.raises(PermissionError):
+        ConsumptionCache(MemoryBackend()).load_snapshot(str(path))
+
+
+def test_batch_lookup_loads_misses_once_and_shares_flights():
+    cache = ConsumptionCache(MemoryBackend())
+    cache.set('electricity_data_2024_1_0_Building_110', [1.0])
+    release = threading.Event()
+    single_calls, batch_calls = [], []
+
+    def single_loader():
+        single_calls.append(1)
+        release.wait(5)
+        return [2.0]
+
+    def batch_loader(keys):
+        batch_calls.append(list(keys))
+        return {key: [3.0] for key in keys if key.endswith('112')}
+
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        single = pool.submit(cache.get_or_load, 'electricity_data_2024_1_0_Building_111', single_loader)
+        time.sleep(0.1)
+        threading.Timer(0.2, release.set).start()
+        results = cache.get_or_load_many([
+            'electricity_data_2024_1_0_Building_110',
+            'electricity_data_2024_1_0_Building_111',
+            'electricity_data_2024_1_0_Building_112',
+            'electricity_data_2024_1_0_Building_999',
+        ], batch_loader)
+        assert single.result() == [2.0]
+
+    assert results['electricity_data_2024_1_0_Building_110'] == ([1.0], results['electricity_data_2024_1_0_Building_110'][1], 'hit')
+    assert results['electricity_data_2024_1_0_Building_111'] == ([2.0], 0.0, 'miss')
+    assert results['electricity_data_2024_1_0_Building_112'] == ([3.0], 0.0, 'miss')
+    assert results['electricity_data_2024_1_0_Building_999'] == (None, 0.0, 'miss')
+    # The key already being loaded is waited for instead of being loaded again
+    assert len(single_calls) == 1
+    assert batch_calls == [['electricity_data_2024_1_0_Building_112', 'electricity_data_2024_1_0_Building_999']]
+
+
+def test_batch_lookup_serves_stale_entries_while_refreshing():
+    cache = ConsumptionCache(MemoryBackend(), default_timeout=60, max_staleness=3600)
+    cache.backend.set('electricity_stats_2024_1_0_Building_110', (time.time() - 120, 60, {'mean': 1.0}))
+    refreshed = threading.Event()
+
+    def refresh(key):
+        refreshed.set()
+        return {'mean': 2.0}
+
+    results = cache.get_or_load_many(['electricity_stats_2024_1_0_Building_110'], lambda keys: {}, refresh)
+
+    assert results['electricity_stats_2024_1_0_Building_110'][0] == {'mean': 1.0}
+    assert results['electricity_stats_2024_1_0_Building_110'][2] == 'stale'
+    assert refreshed.wait(5)
+
+
+def test_period_matcher_selects_keys_derived_from_touched_months():
+    depends = period_key_matcher({('Building 110', 2024, 1)})
+
+    assert depends('electricity_data_2024_1_all_Building_110')
+    assert depends('electricity_data_2024_1_5_Building_110')
+    assert depends('electricity_stats_2024_1_all_Building_110')
+    assert depends('electricity_stats_2024_7_all_Building_110')  # Yearly statistics
+    assert depends('electricity_range_2023-12-01_2024-02-01_week_0_Building_110')
+    assert not depends('electricity_data_2024_2_all_Building_110')
+    assert not depends('electricity_data_2024_11_all_Building_110')
+    assert not depends('electricity_stats_2023_1_all_Building_110')
+    assert not depends('electricity_stats_2024_7_3_Building_110')
+    assert not depends('electricity_data_2024_1_all_Building_1100')
+    assert not depends('electricity_range_2024-01-01_2024-02-01_day_0_Old_Building_110')
+    assert not depends('available_data')
+
+
+def test_campus_invalidation_lists_keys_once():
+    cache = ConsumptionCache(MemoryBackend())
+    buildings = [f'Building {number}' for number in range(200)]
+    for building in buildings:
+        for month in range(1, 13):
+            for day in ('all', 1, 2):
+                cache.set(f"electricity_data_2024_{month}_{day}_{building.replace(' ', '_')}", [])
+        cache.set(f"electricity_data_2023_1_all_{building.replace(' ', '_')}", [])
+    periods = {(building, 2024, month) for building in buildings for month in range(1, 13)}
+
+    start = time.perf_counter()
+    deleted = cache.delete_where(period_key_matcher(periods))
+
+    assert time.perf_counter() - start < 1
+    assert len(deleted) == 200 * 12 * 3
+    assert len(cache.keys()) == 200
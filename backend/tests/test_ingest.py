@@ -0,0 +1,105 @@
+from datetime import date, datetime, timedelta
+
+import pytest
+
+import ingest
+from models import db, ElectricityData, ElectricityStatistics
+
+
+def make_csv(buildings, days, start=datetime(2024, 1, 1), value=100.0):
+    """Meter export with one row per building and one column per day"""
+    header = ['Group', 'Unit'] + [(start + timedelta(days=day)).strftime(ingest.DATE_FORMAT) for day in range(days)]
+    rows = [header] + [[f'Building {building}', 'kWh'] + [str(value + day) for day in range(days)] for building in buildings]
+    return ''.join(','.join(row) + '\n' for row in rows)
+
+
+def readings(days, start=datetime(2024, 1, 1), value=100.0):
+    return [(start + timedelta(days=day), value + day) for day in range(days)]
+
+
+def stored_pairs():
+    return {(building, day) for building, day in db.session.query(ElectricityData.building, ElectricityData.date)}
+
+
+@pytest.fixture
+def spool(tmp_path):
+    """Write CSV text to a file the way /upload spools it and return (filename, path)"""
+    def write(name, text):
+        path = tmp_path / name
+        path.write_text(text)
+        return name, str(path)
+    return write
+
+
+def test_bulk_insert_writes_every_building(app):
+    rows = ingest.bulk_insert_readings({'Building 110': readings(3), 'Building 111': readings(2)})
+    db.session.commit()
+
+    assert len(rows) == 5
+    assert {(row['building'], row['date']) for row in rows} == stored_pairs()
+    assert {row['month'] for row in rows} == {'January'}
+
+
+def test_bulk_insert_keeps_the_first_reading_of_each_day(app):
+    day = datetime(2024, 1, 1)
+    rows = ingest.bulk_insert_readings({'Building 110': [(day, 1.0), (day.replace(hour=12), 2.0)]})
+
+    assert [(row['date'], row['consumption']) for row in rows] == [(date(2024, 1, 1), 1.0)]
+
+
+def test_bulk_insert_skips_stored_days(app):
+    ingest.bulk_insert_readings({'Building 110': readings(3)})
+    db.session.commit()
+
+    rows = ingest.bulk_insert_readings({'Building 110': readings(5), 'Building 111': readings(1)})
+
+    assert sorted((row['building'], row['date']) for row in rows) == [
+        ('Building 110', date(2024, 1, 4)), ('Building 110', date(2024, 1, 5)), ('Building 111', date(2024, 1, 1))
+    ]
+
+
+def test_ingest_files_counts_reuploads_as_duplicates(app, spool):
+    upload = [spool('campus.csv', make_csv([110, 111], 4))]
+
+    first, _ = ingest.ingest_files(upload)
+    second, _ = ingest.ingest_files(upload)
+
+    assert (first[0]['rows_written'], first[0]['duplicates_skipped']) == (8, 0)
+    assert (second[0]['rows_written'], second[0]['duplicates_skipped']) == (0, 8)
+    assert first[0]['buildings'] == ['Building 110', 'Building 111']
+    assert first[0]['months'] == [('Building 110', 2024, 1), ('Building 111', 2024, 1)]
+    assert second[0]['months'] == []
+    assert db.session.query(ElectricityData).count() == 8
+
+
+def test_ingest_files_writes_statistics_for_every_building(app, spool):
+    ingest.ingest_files([spool('campus.csv', make_csv([110, 111], 3))])
+
+    stats = {row.building: row.mean for row in ElectricityStatistics.query}
+    assert stats == {'Building 110': 101.0, 'Building 111': 101.0}
+
+
+def test_failed_write_is_rolled_back_without_undoing_other_files(app, spool, monkeypatch):
+    real_refresh = ingest.refresh_monthly_statistics
+
+    def failing_refresh(keys):
+        if any(building == 'Building 111' for building, _ in keys):
+            raise RuntimeError('statistics failed')
+        return real_refresh(keys)
+
+    monkeypatch.setattr(ingest, 'refresh_monthly_statistics', failing_refresh)
+    uploads = [
+        spool('110.csv', make_csv([110], 3)),
+        spool('111.csv', make_csv([111], 3)),
+        spool('112.csv', make_csv([112], 3)),
+        spool('bad.csv', 'Building 113,kWh,1\n')
+    ]
+
+    results, _ = ingest.ingest_files(uploads)
+
+    assert [result['filename'] for result in results] == ['110.csv', '111.csv', '112.csv', 'bad.csv']
+    assert [result.get('rows_written') for result in results] == [3, None, 3, None]
+    assert 'statistics failed' in results[1]['error']
+    assert "'Group' column" in results[3]['error']
+    # The failed file's inserted readings went with its savepoint
+    assert {building for building, _ in stored_pairs()} == {'Building 110', 'Building 112'}
@@ -0,0 +1,113 @@
+import csv
+import io
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+import ingest
+
+
+def make_csv(buildings, columns, trailing_comma=False, line_end='\n'):
+    """Meter export with one row per building and one column per day"""
+    start = datetime(2024, 1, 1)
+    header = ['Group', 'Unit'] + [(start + timedelta(days=day)).strftime(ingest.DATE_FORMAT) for day in range(columns)]
+    rows = [header] + [
+        [f'Building {building}', 'kWh'] + [f'{building + day / 10:.1f}' for day in range(columns)]
+        for building in buildings
+    ]
+    suffix = ',' if trailing_comma else ''
+    return ''.join(','.join(row) + suffix + line_end for row in rows)
+
+
+def reference_rows(text):
+    return [[field.strip('\r"\ufeff ') for field in row] for row in csv.reader(io.StringIO(text)) if row]
+
+
+def joined_rows(text, chunk_columns):
+    rows = {}
+    for row_number, fields, _ in ingest._iter_field_chunks(io.StringIO(text), chunk_columns):
+        rows.setdefault(row_number, []).extend(fields)
+    return [rows[row_number] for row_number in sorted(rows)]
+
+
+@pytest.mark.parametrize('block_size', [1, 2, 3, 5, 7, 16, 1 << 16])
+@pytest.mark.parametrize('chunk_columns', [1, 2, 3, 4, 6, 4096])
+@pytest.mark.parametrize('trailing_comma', [False, True])
+@pytest.mark.parametrize('line_end', ['\n', '\r\n'])
+def test_field_chunks_match_csv_reader(monkeypatch, block_size, chunk_columns, trailing_comma, line_end):
+    monkeypatch.setattr(ingest, 'READ_BLOCK_SIZE', block_size)
+    text = make_csv([110, 111, 112], 4, trailing_comma, line_end)
+
+    assert joined_rows(text, chunk_columns) == reference_rows(text)
+
+
+@pytest.mark.parametrize('block_size', [1, 4, 9, 1 << 16])
+def test_row_complete_marks_last_chunk_of_each_row(monkeypatch, block_size):
+    monkeypatch.setattr(ingest, 'READ_BLOCK_SIZE', block_size)
+    text = make_csv([110, 111], 4, trailing_comma=True)
+
+    chunks = list(ingest._iter_field_chunks(io.StringIO(text), 2))
+    last_per_row = {}
+    for index, (row_number, _, _) in enumerate(chunks):
+        last_per_row[row_number] = index
+    assert [row_complete for _, _, row_complete in chunks] == [index in last_per_row.values() for index in range(len(chunks))]
+
+
+def test_blank_lines_are_skipped():
+    text = make_csv([110], 3).replace('\n', '\n\n', 1) + '\n'
+
+    assert joined_rows(text, 4096) == reference_rows(text)
+
+
+def test_last_row_without_line_break(monkeypatch):
+    monkeypatch.setattr(ingest, 'READ_BLOCK_SIZE', 3)
+    text = make_csv([110, 111], 3, trailing_comma=True).rstrip('\n')
+
+    assert joined_rows(text, 2) == reference_rows(text)
+
+
+@pytest.mark.parametrize('block_size', [2, 5, 1 << 16])
+@pytest.mark.parametrize('chunk_columns', [1, 3, 4096])
+@pytest.mark.parametrize('trailing_comma', [False, True])
+def test_parse_meter_csv_at_chunk_boundaries(monkeypatch, block_size, chunk_columns, trailing_comma):
+    monkeypatch.setattr(ingest, 'READ_BLOCK_SIZE', block_size)
+    monkeypatch.setattr(ingest, 'CHUNK_COLUMNS', chunk_columns)
+    monkeypatch.setattr(ingest.iter_meter_chunks, '__defaults__', (chunk_columns,))
+    text = make_csv([110, 111], 5, trailing_comma)
+
+    parsed = ingest.parse_meter_csv(io.BytesIO(text.encode()))
+
+    assert sorted(parsed['readings']) == ['Building 110', 'Building 111']
+    for building in (110, 111):
+        readings = parsed['readings'][f'Building {building}']
+        assert [timestamp for timestamp, _ in readings] == [datetime(2024, 1, 1) + timedelta(days=day) for day in range(5)]
+        assert np.allclose([value for _, value in readings], [building + day / 10 for day in range(5)])
+
+
+def test_iter_meter_chunks_closes_files_it_opens(tmp_path):
+    path = tmp_path / 'export.csv'
+    path.write_text(make_csv([110], 3))
+    opened = []
+    real_open = open
+
+    def tracking_open(*args, **kwargs):
+        stream = real_open(*args, **kwargs)
+        opened.append(stream)
+        return stream
+
+    ingest.open = tracking_open
+    try:
+        chunks = list(ingest.iter_meter_chunks(str(path)))
+    finally:
+        del ingest.open
+
+    assert [building for building, _, _ in chunks] == ['Building 110']
+    assert len(opened) == 1 and opened[0].closed
+
+
+def test_rows_without_building_number_are_rejected():
+    text = make_csv([110], 2) + 'Campus total,kWh,1,2\n'
+
+    with pytest.raises(ValueError, match='no building number'):
+        ingest.parse_meter_csv(io.StringIO(text))
@@ -0,0 +1,55 @@
+from datetime import date
+
+from models import db, ElectricityData, ElectricityStatistics
+from monthly_stats import next_month_start, refresh_monthly_statistics
+
+
+def add_readings(building, readings):
+    db.session.add_all(
+        ElectricityData(month=day.strftime('%B'), date=day, consumption=consumption, building=building)
+        for day, consumption in readings
+    )
+
+
+def stats(building, month_start):
+    row = ElectricityStatistics.query.filter_by(building=building, date=month_start).one()
+    return row.mean, row.highest, row.lowest, row.median
+
+
+def test_next_month_start_rolls_over_the_year():
+    assert next_month_start(date(2024, 1, 1)) == date(2024, 2, 1)
+    assert next_month_start(date(2024, 12, 1)) == date(2025, 1, 1)
+
+
+def test_month_split_over_two_files_covers_every_stored_day(app):
+    add_readings('Building 110', [(date(2024, 1, 1), 10.0), (date(2024, 1, 2), 10.0)])
+    refresh_monthly_statistics({('Building 110', date(2024, 1, 1))})
+    db.session.commit()
+    assert stats('Building 110', date(2024, 1, 1)) == (10.0, 10.0, 10.0, 10.0)
+
+    add_readings('Building 110', [(date(2024, 1, 20), 40.0)])
+    refresh_monthly_statistics({('Building 110', date(2024, 1, 1))})
+    db.session.commit()
+
+    assert stats('Building 110', date(2024, 1, 1)) == (20.0, 40.0, 10.0, 10.0)
+    assert ElectricityStatistics.query.count() == 1
+
+
+def test_only_touched_months_are_written(app):
+    add_readings('Building 110', [(date(2024, 1, 5), 1.0), (date(2024, 2, 5), 2.0), (date(2024, 3, 5), 3.0)])
+    add_readings('Building 111', [(date(2024, 2, 5), 4.0)])
+
+    written = refresh_monthly_statistics({('Building 110', date(2024, 1, 1)), ('Building 110', date(2024, 3, 1))})
+    db.session.commit()
+
+    assert written == 2
+    assert sorted((row.building, row.date, row.month) for row in ElectricityStatistics.query) == [
+        ('Building 110', date(2024, 1, 1), 'January'), ('Building 110', date(2024, 3, 1), 'March')
+    ]
+    assert stats('Building 110', date(2024, 3, 1)) == (3.0, 3.0, 3.0, 3.0)
+
+
+def test_no_keys_or_no_readings_write_nothing(app):
+    assert refresh_monthly_statistics(set()) == 0
+    assert refresh_monthly_statistics({('Building 110', date(2024, 1, 1))}) == 0
+    assert ElectricityStatistics.query.count() == 0
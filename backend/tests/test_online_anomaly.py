@@ -0,0 +1,46 @@
+from datetime import date, datetime, timedelta
+
+from ingest import bulk_insert_readings
+from models import db, AnomalyAlert, AnomalyState
+from online_anomaly import score_new_readings
+
+
+def state_of(building):
+    state = AnomalyState.query.filter_by(building=building).one()
+    return state.count, state.mean, state.ewma, state.ewm_var, state.last_date
+
+
+def insert(days, value=lambda day: 100.0 + day % 5, building='Building 110'):
+    readings = {building: [(datetime(2024, 1, 1) + timedelta(days=day), value(day)) for day in days]}
+    rows = bulk_insert_readings(readings)
+    score_new_readings(rows)
+    db.session.commit()
+    return rows
+
+
+def test_spike_after_warm_up_is_flagged(app):
+    insert(range(30))
+    insert([30], value=lambda day: 500.0)
+
+    alerts = AnomalyAlert.query.all()
+    assert [(alert.date, alert.severity) for alert in alerts] == [(date(2024, 1, 31), 'Critical')]
+    assert state_of('Building 110')[0] == 31
+
+
+def test_back_filled_readings_leave_the_state_alone(app):
+    insert(range(10, 40))
+    before = state_of('Building 110')
+
+    rows = insert(range(0, 10), value=lambda day: 500.0)
+
+    assert len(rows) == 10
+    assert state_of('Building 110') == before
+    assert AnomalyAlert.query.count() == 0
+
+
+def test_re_uploading_a_file_scores_nothing_twice(app):
+    insert(range(30))
+    before = state_of('Building 110')
+
+    assert insert(range(30)) == []
+    assert state_of('Building 110') == before
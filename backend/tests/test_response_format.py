@@ -0,0 +1,46 @@
+import gzip
+import json
+
+from flask import Flask, jsonify, request
+
+from response_format import compress_response, matching_etag, to_columnar
+
+
+def test_columnar_lifts_only_constant_keys():
+    rows = [
+        {'date': '2024-01-01', 'consumption': 5.0, 'days': 7, 'building': 'Building 110', 'month': 'January'},
+        {'date': '2024-01-08', 'consumption': 5.0, 'days': 7, 'building': 'Building 110', 'month': 'January'},
+    ]
+
+    columnar = to_columnar(rows)
+
+    assert columnar['building'] == 'Building 110' and columnar['month'] == 'January'
+    assert columnar['columns'] == {
+        'date': ['2024-01-01', '2024-01-08'],
+        'consumption': [5.0, 5.0],
+        'days': [7, 7],
+    }
+
+
+def test_columnar_keeps_varying_constant_keys_as_columns():
+    rows = [{'month': 'January', 'consumption': 1.0}, {'month': 'February', 'consumption': 2.0}]
+
+    assert to_columnar(rows)['columns'] == {'month': ['January', 'February'], 'consumption': [1.0, 2.0]}
+    assert to_columnar([{'consumption': 1.0}])['columns'] == {'consumption': [1.0]}
+
+
+def test_compressed_responses_get_their_own_etag():
+    app = Flask(__name__)
+    payload = {'values': list(range(1000))}
+    with app.test_request_context(headers={'Accept-Encoding': 'gzip'}):
+        response = jsonify(payload)
+        response.set_etag('abc')
+        response = compress_response(response, request.accept_encodings)
+
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert response.get_etag() == ('abc-gzip', False)
+        assert json.loads(gzip.decompress(response.get_data())) == payload
+
+    with app.test_request_context(headers={'If-None-Match': '"abc-gzip"'}):
+        assert matching_etag(request.if_none_match, 'abc') == 'abc-gzip'
+        assert matching_etag(request.if_none_match, 'abd') is None
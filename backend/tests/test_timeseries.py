@@ -0,0 +1,32 @@
+import numpy as np
+import pytest
+
+from timeseries import aggregate_readings, lttb
+
+
+@pytest.mark.parametrize('max_points', [-1, 0, 1, 2])
+def test_lttb_rejects_budgets_below_three(max_points):
+    with pytest.raises(ValueError):
+        lttb(np.arange(10), np.arange(10), max_points)
+
+
+def test_lttb_keeps_short_series_whole():
+    assert list(lttb(np.arange(5), np.arange(5), 5)) == [0, 1, 2, 3, 4]
+
+
+def test_lttb_keeps_endpoints_and_order():
+    x = np.arange(1000)
+    y = np.sin(x / 50)
+    kept = lttb(x, y, 40)
+
+    assert len(kept) == 40
+    assert kept[0] == 0 and kept[-1] == 999
+    assert np.all(np.diff(kept) > 0)
+
+
+def test_weekly_buckets_start_on_monday():
+    dates = np.arange(np.datetime64('2024-01-03'), np.datetime64('2024-01-21'))
+    weeks = aggregate_readings(dates, np.ones(len(dates)), 'week')
+
+    assert [str(day.date()) for day in weeks.index] == ['2024-01-01', '2024-01-08', '2024-01-15']
+    assert list(weeks['days']) == [5, 7, 6]
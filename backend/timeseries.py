@@ -0,0 +1,87 @@
+import numpy as np
+import pandas as pd
+
+# pandas period frequency for each supported resolution
+RESOLUTIONS = {
+    'day': 'D',
+    'week': 'W-SUN',
+    'month': 'M'
+}
+
+
+def aggregate_readings(dates, values, resolution='day'):
+    """
+    Aggregate daily readings into day, week or month buckets with one vectorized groupby.
+
+    Args:
+        dates: Sequence of dates in ascending order
+        values: Sequence of consumption values, parallel to dates
+        resolution: 'day', 'week' (Monday to Sunday) or 'month'
+
+    Returns:
+        DataFrame indexed by bucket start date with mean, highest, lowest, total and
+        days columns (empty if there are no readings)
+    """
+    if resolution not in RESOLUTIONS:
+        raise ValueError(f"Unsupported resolution: {resolution}")
+
+    frame = pd.DataFrame({'consumption': np.asarray(values, dtype=float)}, index=pd.DatetimeIndex(dates))
+    if frame.empty:
+        return pd.DataFrame(columns=['mean', 'highest', 'lowest', 'total', 'days'])
+
+    buckets = frame.index.to_period(RESOLUTIONS[resolution]).start_time
+    grouped = frame['consumption'].groupby(buckets).agg(['mean', 'max', 'min', 'sum', 'count'])
+    grouped.columns = ['mean', 'highest', 'lowest', 'total', 'days']
+    return grouped
+
+
+def lttb(x, y, max_points):
+    """
+    Downsample a series to max_points with Largest-Triangle-Three-Buckets.
+
+    Keeps the first and last points and, from each bucket in between, the point that forms
+    the largest triangle with the previously kept point and the next bucket's average,
+    so peaks and dips survive the reduction.
+
+    Args:
+        x: Numeric x values in ascending order (e.g. timestamps)
+        y: y values, parallel to x
+        max_points: Number of points to keep (at least 3)
+
+    Returns:
+        numpy array with the indexes of the kept points (all of them when the series
+        already fits in max_points)
+
+    Raises:
+        ValueError: If max_points is less than 3
+    """
+    if max_points < 3:
+        raise ValueError("max_points must be at least 3")
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = len(x)
+    if max_points >= n:
+        return np.arange(n)
+
+    # Bucket edges over the interior points; the first and last points are always kept
+    edges = np.linspace(1, n - 1, max_points - 1).astype(int)
+    kept = np.empty(max_points, dtype=int)
+    kept[0], kept[-1] = 0, n - 1
+
+    previous = 0
+    for bucket in range(max_points - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        # Average of the next bucket (the last point for the final bucket)
+        next_start = end
+        next_end = edges[bucket + 2] if bucket + 2 < len(edges) else n
+        next_x = x[next_start:next_end].mean()
+        next_y = y[next_start:next_end].mean()
+
+        areas = np.abs(
+            (x[previous] - next_x) * (y[start:end] - y[previous])
+            - (x[previous] - x[start:end]) * (next_y - y[previous])
+        )
+        previous = start + int(np.argmax(areas))
+        kept[bucket + 1] = previous
+
+    return kept
@@ -0,0 +1,91 @@
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+
+class UploadJobQueue:
+    """
+    In-process queue of background upload jobs.
+
+    Jobs run one at a time on a single worker thread so database writes from
+    different uploads never compete, and their progress can be polled by id.
+    """
+
+    def __init__(self, max_finished=100):
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='upload-job')
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._max_finished = max_finished
+
+    def submit(self, filenames, work):
+        """
+        Queue an upload job.
+
+        Args:
+            filenames: Names of the uploaded files
+            work: Callable taking a progress callback and returning (results, timing)
+
+        Returns:
+            The new job id
+        """
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._jobs[job_id] = {
+                'job_id': job_id,
+                'status': 'queued',
+                'files_total': len(filenames),
+                'files_done': 0,
+                'rows_written': 0,
+                'duplicates_skipped': 0,
+                'anomalies': 0,
+                'errors': [],
+                'results': None,
+                'timing': None,
+                'submitted_at': datetime.now().isoformat(),
+                'started_at': None,
+                'finished_at': None
+            }
+            self._prune()
+        self._executor.submit(self._run, job_id, work)
+        return job_id
+
+    def status(self, job_id):
+        """Return a snapshot of the job's state, or None if the id is unknown"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            return {**job, 'errors': list(job['errors'])}
+
+    def _run(self, job_id, work):
+        self._update(job_id, status='running', started_at=datetime.now().isoformat())
+        try:
+            results, timing = work(lambda result: self._record(job_id, result))
+            self._update(job_id, status='completed', results=results, timing=timing)
+        except Exception as e:
+            self._update(job_id, status='failed', error=str(e))
+        finally:
+            self._update(job_id, finished_at=datetime.now().isoformat())
+
+    def _record(self, job_id, result):
+        """Progress callback: fold one file's result into the job counters"""
+        with self._lock:
+            job = self._jobs[job_id]
+            job['files_done'] += 1
+            job['rows_written'] += result.get('rows_written', 0)
+            job['duplicates_skipped'] += result.get('duplicates_skipped', 0)
+            job['anomalies'] += result.get('anomalies', 0)
+            if 'error' in result:
+                job['errors'].append({'filename': result['filename'], 'error': result['error']})
+
+    def _update(self, job_id, **fields):
+        with self._lock:
+            self._jobs[job_id].update(fields)
+
+    def _prune(self):
+        """Forget the oldest finished jobs once more than max_finished are kept"""
+        finished = [job_id for job_id, job in self._jobs.items() if job['finished_at']]
+        for job_id in finished[:max(0, len(finished) - self._max_finished)]:
+            del self._jobs[job_id]
@@ -613,6 +613,8 @@ const AlertPage = () => {
                   >
                     <option value="LOF">Local Outlier Factor</option>
                     <option value="z_score">Z-Score Method</option>
+                    <option value="rolling_z_score">Rolling Z-Score (30 days)</option>
+                    <option value="mad">Median/MAD (Robust)</option>
                   </select>
                 </div>
               </div>
@@ -623,15 +623,16 @@ const loadSelectedBuildingFromLocalStorage = () => {
       const day = newDate.getDate();
       const dateKey = `${year}-${month}-${day}`;
 
+      // Buildings with data for this date that are not cached in the browser yet
+      const toFetch = [];
+      const withData = [];
       for (const buildingName of Object.keys(updatedBuildings)) {
         // First check if data is available for the building
         if (!availableData[buildingName]) {
           console.log('No data available for building:', buildingName);
           continue;
         }
-  
-        
-  
+
         const buildingInfo = availableData[buildingName];
         console.log(`Available data for ${buildingName}:`, buildingInfo);
   
@@ -649,33 +650,34 @@ const loadSelectedBuildingFromLocalStorage = () => {
           continue;
         }
 
-        
-        let statsData;
-        // Check if data is already cached for this date
+        withData.push(buildingName);
         if (updatedBuildings[buildingName]?.data?.[dateKey]) {
-          statsData = updatedBuildings[buildingName].data[dateKey];
           console.log(`Using cached data for ${buildingName} on ${dateKey}`);
         } else {
-          // Fetch data if not cached
-          const API_URL = `http://127.0.0.1:5000/fetch-data/${year}/${month}/${day}/${buildingName}`;
-          console.log(`Fetching stats for ${buildingName} from ${API_URL}`);
+          toFetch.push(buildingName);
+        }
+      }
 
-          const response = await fetch(API_URL);
-          if (!response.ok) {
-            throw new Error(`HTTP error! status: ${response.status}`);
-          }
-          const data = await response.json();
+      if (toFetch.length > 0) {
+        // Fetch readings and stats for every uncached building in one request
+        const API_URL = `http://127.0.0.1:5000/fetch-batch/${year}/${month}/${day}`;
+        console.log(`Fetching stats for ${toFetch.length} buildings from ${API_URL}`);
 
-          const API_URL2 = `http://127.0.0.1:5000/stats/${year}/${month}/${day}/${buildingName}`;
-          console.log(`Fetching stats for ${buildingName} from ${API_URL2}`);
+        const response = await fetch(API_URL, {
+          method: 'POST',
+          headers: { 'Content-Type': 'application/json' },
+          body: JSON.stringify({ buildings: toFetch })
+        });
+        if (!response.ok) {
+          throw new Error(`HTTP error! status: ${response.status}`);
+        }
+        const batch = await response.json();
 
-          const response2 = await fetch(API_URL2);
-          if (!response2.ok) {
-            throw new Error(`HTTP error! status: ${response2.status}`);
-          }
-          const stat_data = await response2.json();
+        for (const buildingName of toFetch) {
+          const data = batch.data[buildingName] || {};
+          const stat_data = batch.stats[buildingName] || {};
 
-          statsData = { 
+          const statsData = { 
             consumption: data.consumption,
             month: `${month}/${year}`,
             day: day,
@@ -685,15 +687,17 @@ const loadSelectedBuildingFromLocalStorage = () => {
             median: stat_data.median,
             color: getHeatmapColor(parseFloat(data.consumption), parseFloat(stat_data.mean))
           };
-          
-    
+
           // Update building stats and colors
           updatedBuildings[buildingName] = {
             ...updatedBuildings[buildingName],
             data: { ...updatedBuildings[buildingName].data, [dateKey]: statsData }
           };
         }
+      }
 
+      for (const buildingName of withData) {
+        const statsData = updatedBuildings[buildingName].data[dateKey];
         updatedBuildings[buildingName] = {
           ...updatedBuildings[buildingName],
           stats: statsData,
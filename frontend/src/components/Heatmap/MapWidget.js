@@ -134,53 +134,44 @@ const MapWidget = () => {
       localStorage.setItem('selectedDate', date.toString());
       
       const buildingNames = Object.keys(buildingList || buildings);
-      const statsPromises = buildingNames.map(buildingName => 
-        fetchBuildingStats(buildingName, date)
-      );
-      
-      await Promise.all(statsPromises);
-    } catch (error) {
-      console.error('Error fetching all building stats:', error);
-      setError('Failed to fetch all building statistics');
-    }
-  };
-
-  // Fetch building stats from API
-  const fetchBuildingStats = async (buildingName, date) => {
-    try {
       const year = date.getFullYear();
       const month = date.getMonth() + 1;
       const day = date.getDate();
-      const API_URL = `http://127.0.0.1:5000/fetch-data/${year}/${month}/${day}/${buildingName}`;
-      const response = await fetch(API_URL);
+
+      // One request for every building's reading and stats
+      const API_URL = `http://127.0.0.1:5000/fetch-batch/${year}/${month}/${day}`;
+      const response = await fetch(API_URL, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ buildings: buildingNames })
+      });
       if (!response.ok) {
         throw new Error(`HTTP error! status: ${response.status}`);
       }
-      const data = await response.json();
-
-      const API_URL2 = `http://127.0.0.1:5000/stats/${year}/${month}/${day}/${buildingName}`;
-      const response2 = await fetch(API_URL2);
-      if (!response2.ok) {
-        throw new Error(`HTTP error! status: ${response2.status}`);
-      }
-      const stat_data = await response2.json();
+      const batch = await response.json();
 
-      const statsData = {
-        consumption: data.consumption,
-        average: stat_data.mean,
-        max: stat_data.highest,
-        min: stat_data.lowest,
-        median: stat_data.median,
-        color: getHeatmapColor(parseFloat(data.consumption), parseFloat(stat_data.mean))
-      };
+      const allStats = {};
+      buildingNames.forEach(buildingName => {
+        const data = batch.data[buildingName];
+        const stat_data = batch.stats[buildingName];
+        if (!data || !stat_data) return;
+        allStats[buildingName] = {
+          consumption: data.consumption,
+          average: stat_data.mean,
+          max: stat_data.highest,
+          min: stat_data.lowest,
+          median: stat_data.median,
+          color: getHeatmapColor(parseFloat(data.consumption), parseFloat(stat_data.mean))
+        };
+      });
 
       setBuildingStats(prev => ({
         ...prev,
-        [buildingName]: statsData
+        ...allStats
       }));
     } catch (error) {
-      console.error(`Error fetching stats for ${buildingName}:`, error);
-      // Don't set global error to prevent error messages for individual building failures
+      console.error('Error fetching all building stats:', error);
+      setError('Failed to fetch all building statistics');
     }
   };
 